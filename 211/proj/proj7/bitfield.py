@@ -16,6 +16,8 @@ representation, but we ignore that because we are trying
 to simulate a machine-level representation.
 """
 
+from typing import Dict, Iterable
+
 import logging
 logging.basicConfig()
 log = logging.getLogger(__name__)
@@ -81,16 +83,18 @@ class BitField(object):
         # are inclusive, e.g., if from_bit=0 and to_bit = 4, then it is a
         # 5 bit field with bits numbered 0, 1, 2, 3, 4.
 
-        # You might want to precompute some additional values in the constructor
-        # rather than recomputing them each time you insert or extract a value.
-        # I precomputed the field width (used in several places), a mask (for
-        # extracting the bits of interest), the inverse of the mask (for clearing
-        # a field before I insert a new value into it), and a couple of other values
-        # that could be useful to have in sign extension (see the sign_extend
-        # function below).
+        # Everything insert and extract need is precomputed here, so
+        # that each of them is just a few shifts and masks:  the field
+        # width, a mask (for extracting the bits of interest), the
+        # inverse of the mask in place (for clearing a field before
+        # inserting a new value into it), and the sign bit (for sign
+        # extension).
         self.from_bit = from_bit
         self.to_bit = to_bit
-
+        self.width = 1 + to_bit - from_bit
+        self.mask = (1 << self.width) - 1
+        self.inverse_mask = ~(self.mask << from_bit)
+        self.sign_bit = 1 << (self.width - 1)
 
     def extract(self, word: int) -> int:
         """Extract the bitfield and return it in the
@@ -98,9 +102,7 @@ class BitField(object):
         bits 3..5, the result will be an
         integer between 0 and 7 (0b000 to 0b111).
         """
-        a = sum([2 ** i for i in range(self.from_bit, self.to_bit+1)])
-        extracted = a & word
-        return extracted >> self.from_bit
+        return (word >> self.from_bit) & self.mask
 
     def insert(self, value: int, word: int) -> int:
         """Insert value, which should be in the low order
@@ -117,48 +119,81 @@ class BitField(object):
         #   field_val is x0000000f
         #   and the field is bits 4..7
         #   then insert gives xaa00aaf0
-
-        # shift the value by from_bit
-        if value < 0:
-            value = 2 ** 31 + value - 1
-            value = self.extract(value)
-        value = value << self.from_bit
-
-        # cut the word in two, 0 - from_bit-1 and to_bit+1 - END
-        right_half, left_half = BitField(0, self.from_bit-1).extract(word), BitField(self.to_bit+1, WORD_SIZE).extract(word)
-
-        # shift the left half by to_bit+1
-        left_half = left_half << self.to_bit+1
-
-        # return the sum of all
-        return right_half + value + left_half
-
+        #
+        # Masking a negative value keeps its low order bits, i.e., its
+        # two's complement representation in the width of the field.
+        return (word & self.inverse_mask) | ((value & self.mask) << self.from_bit)
 
     def extract_signed(self, word: int) -> int:
         """Extract bits in bitfield as a signed integer."""
-        # method extract takes a word and returns the value of the field
-        # (which was set in the constructor)
-        #
-        # method extract_signed does the same as extract, but then if the
-        # sign bit of the field is 1, it sign-extends the value to form the
-        # appropriate negative integer.  extract_signed could call the function
-        # extract_signed below, but you may prefer to incorporate that logic into
-
-        # make a list of the 0s and 1s in word
-        extracted = [int(i) for i in bin(self.extract(word))[2:]]
-        res = 0
-
-        # go through the made list and subtract the first one and add the rest in a accumilator pattern
-        for i, num in enumerate(extracted):
-            if i == 0 and self.to_bit - self.from_bit + 1 == len(extracted):
-                res -= 2 ** (len(extracted) - 1) * num
-                continue
-            res += 2 ** (len(extracted) - 1 -i) * num
-
-        # return the sum
-        return res
+        # Flipping the sign bit and then subtracting it leaves positive
+        # values unchanged and sign extends negative ones, the same as
+        # the sign_extend function above but without a branch.
+        raw = (word >> self.from_bit) & self.mask
+        return (raw ^ self.sign_bit) - self.sign_bit
+
+
+class RecordLayout(object):
+    """Several named bitfields that make up one word, e.g., the
+    fields of an instruction.  pack and unpack handle all of the
+    fields in one call, using functions compiled for the layout,
+    so a record costs one function call instead of one per field.
+    """
+    def __init__(self, fields: Dict[str, BitField], signed: Iterable[str]=()) -> None:
+        """fields maps each field name to its BitField.  Fields named
+        in signed are sign extended by unpack.
+        """
+        self.fields = dict(fields)
+        signed = set(signed)
+        names = list(self.fields)
+        packed = [f"(({name} & {field.mask}) << {field.from_bit})"
+                  for name, field in self.fields.items()]
+        unpacked = [ ]
+        for name, field in self.fields.items():
+            raw = f"((word >> {field.from_bit}) & {field.mask})"
+            if name in signed:
+                raw = f"(({raw} ^ {field.sign_bit}) - {field.sign_bit})"
+            unpacked.append(f"{name!r}: {raw}")
+        source = (f"def pack({', '.join(name + '=0' for name in names)}):\n"
+                  + f"    return {' | '.join(packed) or '0'}\n"
+                  + "def unpack(word):\n"
+                  + f"    return {{{', '.join(unpacked)}}}\n")
+        namespace = { }
+        exec(source, namespace)
+        self.pack = namespace["pack"]
+        self.unpack = namespace["unpack"]
+
+
+def benchmark(repeat: int=200000) -> None:
+    """Time each operation on narrow and wide fields at both ends
+    of the word.  The time per operation should not depend on
+    the field:  the last line gives the slowest field's time as a
+    multiple of the fastest, which should be close to 1.
+    """
+    import timeit
+    word = 0x8badf00d
+    print(f"{'field':>8} {'extract':>9} {'signed':>9} {'insert':>9}   (ns/op)")
+    columns = [[ ], [ ], [ ]]
+    for from_bit, to_bit in [(0, 0), (0, 9), (26, 30), (0, 31), (16, 31)]:
+        field = BitField(from_bit, to_bit)
+        times = [timeit.timeit(lambda: field.extract(word), number=repeat),
+                 timeit.timeit(lambda: field.extract_signed(word), number=repeat),
+                 timeit.timeit(lambda: field.insert(-1, word), number=repeat)]
+        for column, t in zip(columns, times):
+            column.append(t)
+        print(f"{from_bit:>3}..{to_bit:<3} "
+              + " ".join(f"{1e9 * t / repeat:>9.1f}" for t in times))
+    print(f"{'max/min':>8} " + " ".join(f"{max(c) / min(c):>9.2f}" for c in columns))
+    layout = RecordLayout({"op": BitField(26, 30), "cond": BitField(22, 25),
+                           "target": BitField(18, 21), "src1": BitField(14, 17),
+                           "src2": BitField(10, 13), "offset": BitField(0, 9)},
+                          signed=["offset"])
+    fields = layout.unpack(word)
+    print(f"{'record':>8} {1e9 * timeit.timeit(lambda: layout.unpack(word), number=repeat) / repeat:>9.1f}"
+          + f" {'':>9} {1e9 * timeit.timeit(lambda: layout.pack(**fields), number=repeat) / repeat:>9.1f}")
 
 if __name__ == '__main__':
     obj = BitField(3, 5)
     print(obj.extract(0b000010111))
     print(BitField(3,5).insert(-1, 0), bin(BitField(3,5).insert(-1, 0)), BitField(3,5).insert(-1, 0) == 56)
+    benchmark()
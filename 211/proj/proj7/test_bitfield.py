@@ -0,0 +1,98 @@
+"""
+Tests for bitfield.py, and for its copy in proj7.py.
+"""
+import bitfield
+import importlib.util
+import os
+import random
+import unittest
+
+
+class TestBitField(unittest.TestCase):
+    module = bitfield
+
+    def test_extract(self):
+        field = self.module.BitField(3, 5)
+        self.assertEqual(field.extract(0b000010111), 0b010)
+        self.assertEqual(self.module.BitField(0, 31).extract(0xFFFFFFFF), 0xFFFFFFFF)
+
+    def test_insert_negative(self):
+        """Negative values are inserted as their low-order bits"""
+        field = self.module.BitField(3, 5)
+        self.assertEqual(field.insert(-1, 0), 0b111000)
+        self.assertEqual(field.insert(-3, 0), 0b101000)
+        self.assertEqual(field.insert(-4, 0), 0b100000)
+        # Bits outside the field are kept, and the old field replaced
+        self.assertEqual(field.insert(-2, 0xFFFFFFFF), 0xFFFFFFF7)
+        self.assertEqual(field.insert(-2, 0b11000001), 0b11110001)
+
+    def test_signed_round_trip(self):
+        """extract_signed undoes insert for every value that fits,
+        in fields of each width at both ends of the word
+        """
+        for width in range(2, 33):
+            low, high = -2 ** (width - 1), 2 ** (width - 1) - 1
+            for from_bit in sorted({0, 32 - width}):
+                field = self.module.BitField(from_bit, from_bit + width - 1)
+                for value in [low, low + 1, -1, 0, 1, high - 1, high]:
+                    for word in [0, 0xFFFFFFFF]:
+                        packed = field.insert(value, word)
+                        self.assertEqual(field.extract_signed(packed), value)
+                        self.assertEqual(self.module.sign_extend(field.extract(packed), width),
+                                         value)
+                        # Nothing outside the field changed
+                        self.assertEqual(field.insert(0, packed), field.insert(0, word))
+
+
+class TestRecordLayout(unittest.TestCase):
+    module = bitfield
+
+    def setUp(self):
+        BitField = self.module.BitField
+        self.fields = {"op": BitField(26, 30), "cond": BitField(22, 25),
+                       "target": BitField(18, 21), "src1": BitField(14, 17),
+                       "src2": BitField(10, 13), "offset": BitField(0, 9)}
+        self.layout = self.module.RecordLayout(self.fields, signed=["offset"])
+
+    def test_matches_bitfields(self):
+        rng = random.Random(211)
+        for _ in range(200):
+            word = rng.getrandbits(31)
+            unpacked = self.layout.unpack(word)
+            for name, field in self.fields.items():
+                expected = (field.extract_signed(word) if name == "offset"
+                            else field.extract(word))
+                self.assertEqual(unpacked[name], expected)
+
+    def test_pack_unpack_inverse(self):
+        rng = random.Random(211)
+        for _ in range(200):
+            word = rng.getrandbits(31)
+            self.assertEqual(self.layout.pack(**self.layout.unpack(word)), word)
+            record = {"op": rng.randrange(32), "cond": rng.randrange(16),
+                      "target": rng.randrange(16), "src1": rng.randrange(16),
+                      "src2": rng.randrange(16), "offset": rng.randint(-512, 511)}
+            self.assertEqual(self.layout.unpack(self.layout.pack(**record)), record)
+
+    def test_missing_fields_are_zero(self):
+        self.assertEqual(self.layout.pack(), 0)
+        self.assertEqual(self.layout.pack(offset=-1), 0x3FF)
+
+
+# proj7.py holds a copy of bitfield.py; run the same tests on it
+_spec = importlib.util.spec_from_file_location(
+    "proj7_copy", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "proj7.py"))
+proj7_copy = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(proj7_copy)
+
+
+class TestBitFieldCopy(TestBitField):
+    module = proj7_copy
+
+
+class TestRecordLayoutCopy(TestRecordLayout):
+    module = proj7_copy
+
+
+if __name__ == "__main__":
+    unittest.main()
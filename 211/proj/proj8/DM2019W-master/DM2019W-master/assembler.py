@@ -0,0 +1,224 @@
+"""
+Assembler for the Duck Machine.
+
+Source lines use the syntax that Instruction.__str__ prints, e.g.,
+
+    ADD/ZP r1,r2,r3[5]    # comment
+
+where the condition (/ZP) and the offset ([5]) may be omitted.  A
+line may begin with a label, "loop:", and may be a data word,
+"DATA 17", instead of an instruction.  As in the .asm files in
+programs/, labels may be used in three short forms, with offsets
+relative to the instruction's own address (r15):
+
+    LOAD r1,x          means   LOAD r1,r0,r15[x - pc]
+    STORE r1,x         means   STORE r1,r0,r15[x - pc]
+    JUMP/Z loop        means   ADD/Z r15,r0,r15[loop - pc]
+
+An Assembler remembers how it parsed and encoded each source
+line, so assembling a program again after a small edit encodes
+only the lines that changed (and label references whose distance
+changed).  Each cache keeps at most CACHE_SIZE entries, dropping
+the least recently used.
+"""
+
+from instr_format import Instruction, OpCode, CondFlag, NAMED_REGS
+
+import re
+from collections import OrderedDict
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Offsets are signed 10-bit fields
+MIN_OFFSET = -512
+MAX_OFFSET = 511
+
+# Entries kept in each of an Assembler's caches
+CACHE_SIZE = 4096
+
+LABEL = r"(?P<label>[A-Za-z_]\w*):"
+# Operation and condition names, like register names, may be in any case
+PATTERNS = {
+    "full": re.compile(r"(?P<op>[A-Z]+)(?:/(?P<cond>[A-Z]+))?\s+"
+                       + r"(?P<target>\w+)\s*,\s*(?P<src1>\w+)\s*,\s*(?P<src2>\w+)"
+                       + r"(?:\s*\[\s*(?P<offset>-?\d+)\s*\])?$", re.IGNORECASE),
+    "memref": re.compile(r"(?P<op>LOAD|STORE)(?:/(?P<cond>[A-Z]+))?\s+"
+                         + r"(?P<target>\w+)\s*,\s*(?P<ref>[A-Z_]\w*)$", re.IGNORECASE),
+    "jump": re.compile(r"JUMP(?:/(?P<cond>[A-Z]+))?\s+(?P<ref>[A-Z_]\w*)$",
+                       re.IGNORECASE),
+    "data": re.compile(r"DATA\s+(?P<value>-?\d+)$", re.IGNORECASE),
+    }
+LABEL_PATTERN = re.compile(r"\s*" + LABEL + r"\s*")
+
+
+class AssemblyError(Exception):
+    """An error in the source program"""
+    def __init__(self, line_num: int, message: str) -> None:
+        super().__init__(f"Line {line_num}: {message}")
+        self.line_num = line_num
+
+
+class Statement(NamedTuple):
+    """A parsed line, not yet encoded.  If ref is a label, the
+    offset is the distance from the statement's address to the label.
+    """
+    op: Optional[OpCode]   # None for DATA
+    cond: CondFlag
+    target: int
+    src1: int
+    src2: int
+    offset: int
+    ref: Optional[str]
+
+
+def _cond(name: Optional[str]) -> CondFlag:
+    if name is None:
+        return CondFlag.ALWAYS
+    name = name.upper()
+    if name in CondFlag.__members__:
+        return CondFlag[name]
+    cond = CondFlag.NEVER
+    for letter in name:
+        if letter not in "MZPV":
+            raise ValueError(f"Unknown condition '{name}'")
+        cond |= CondFlag[letter]
+    return cond
+
+
+def _reg(name: str) -> int:
+    if name.lower() not in NAMED_REGS:
+        raise ValueError(f"Unknown register '{name}'")
+    return NAMED_REGS[name.lower()]
+
+
+def parse(code: str) -> Statement:
+    """Parse one instruction or DATA directive, with no label
+    or comment.  Raises ValueError if it is malformed.
+    """
+    match = PATTERNS["data"].match(code)
+    if match:
+        return Statement(None, CondFlag.NEVER, 0, 0, 0, int(match.group("value")), None)
+    match = PATTERNS["jump"].match(code)
+    if match:
+        return Statement(OpCode.ADD, _cond(match.group("cond")), 15, 0, 15, 0,
+                         match.group("ref"))
+    match = PATTERNS["memref"].match(code)
+    if match:
+        return Statement(OpCode[match.group("op").upper()], _cond(match.group("cond")),
+                         _reg(match.group("target")), 0, 15, 0, match.group("ref"))
+    match = PATTERNS["full"].match(code)
+    if not match:
+        raise ValueError(f"Cannot parse '{code}'")
+    op_name = match.group("op").upper()
+    if op_name not in OpCode.__members__:
+        raise ValueError(f"Unknown operation '{op_name}'")
+    return Statement(OpCode[op_name], _cond(match.group("cond")),
+                     _reg(match.group("target")), _reg(match.group("src1")),
+                     _reg(match.group("src2")), int(match.group("offset") or 0), None)
+
+
+def split_line(line: str) -> Tuple[Optional[str], str]:
+    """Label (or None) and code of a source line, without its comment"""
+    line = line.split("#", 1)[0]
+    match = LABEL_PATTERN.match(line)
+    if match:
+        return match.group("label"), line[match.end():].strip()
+    return None, line.strip()
+
+
+class Assembler(object):
+    """Translates source text to a list of words.  Parsed lines and
+    encoded words are cached between calls to assemble, at most
+    cache_size of each.
+    """
+
+    def __init__(self, cache_size: int=CACHE_SIZE) -> None:
+        self.cache_size = cache_size
+        self.parsed: Dict[str, Statement] = OrderedDict()
+        self.encoded: Dict[Tuple[Statement, int], int] = OrderedDict()
+        self.encodings = 0   # Words encoded, i.e., cache misses
+
+    def _remember(self, cache: OrderedDict, key: object, value: object) -> None:
+        cache[key] = value
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _parse(self, code: str) -> Statement:
+        statement = self.parsed.get(code)
+        if statement is None:
+            statement = parse(code)
+            self._remember(self.parsed, code, statement)
+        else:
+            self.parsed.move_to_end(code)
+        return statement
+
+    def _encode(self, statement: Statement, offset: int) -> int:
+        key = (statement, offset)
+        word = self.encoded.get(key)
+        if word is None:
+            if statement.op is None:
+                word = statement.offset
+            else:
+                word = Instruction(statement.op, statement.cond, statement.target,
+                                   statement.src1, statement.src2, offset).encode()
+            self.encodings += 1
+            self._remember(self.encoded, key, word)
+        else:
+            self.encoded.move_to_end(key)
+        return word
+
+    def assemble(self, source: List[str]) -> List[int]:
+        """Words for the source lines, to be loaded at address 0"""
+        # Pass 1: addresses of labels
+        labels: Dict[str, int] = { }
+        statements: List[Tuple[int, Statement]] = [ ]
+        for line_num, line in enumerate(source, start=1):
+            label, code = split_line(line)
+            if label is not None:
+                if label in labels:
+                    raise AssemblyError(line_num, f"Duplicate label '{label}'")
+                labels[label] = len(statements)
+            if code:
+                try:
+                    statements.append((line_num, self._parse(code)))
+                except ValueError as e:
+                    raise AssemblyError(line_num, str(e))
+        # Pass 2: resolve labels and encode
+        words = [ ]
+        for addr, (line_num, statement) in enumerate(statements):
+            offset = statement.offset
+            if statement.ref is not None:
+                if statement.ref not in labels:
+                    raise AssemblyError(line_num, f"Undefined label '{statement.ref}'")
+                offset = labels[statement.ref] - addr
+            if statement.op is not None and not MIN_OFFSET <= offset <= MAX_OFFSET:
+                raise AssemblyError(line_num, f"Offset {offset} out of range")
+            words.append(self._encode(statement, offset))
+        return words
+
+
+def assemble(source: List[str]) -> List[int]:
+    """Assemble source lines once, without keeping a cache"""
+    return Assembler().assemble(source)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Duck Machine assembler")
+    parser.add_argument("sourcefile", type=argparse.FileType("r"),
+                        help="Assembly code (.asm) input")
+    parser.add_argument("objfile", type=argparse.FileType("w"),
+                        help="Object code (.obj) output")
+    args = parser.parse_args()
+    try:
+        words = assemble(args.sourcefile.readlines())
+    except AssemblyError as e:
+        log.error(e)
+        raise SystemExit(1)
+    for word in words:
+        print(word, file=args.objfile)
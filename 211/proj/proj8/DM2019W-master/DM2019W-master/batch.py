@@ -0,0 +1,139 @@
+"""
+Run many Duck Machine jobs in parallel.
+
+A manifest lists jobs, one JSON object per line, e.g.,
+
+    {"objfile": "programs/sum.obj", "input": [3, 4, 0]}
+
+Each job runs on its own CPU and memory in a pool of worker
+processes.  The console addresses 510 and 511 read from the job's
+input tape and write to its output tape instead of the keyboard
+and screen.  Results are written one JSON object per line, in
+manifest order:
+
+    {"objfile": "programs/sum.obj", "output": [7],
+     "halt": "halted", "steps": 42}
+
+The halt reason is "halted" for a HALT instruction, "overflow"
+for an arithmetic error, "segfault" for a bad address, "end of
+input" if the program reads past the end of its input tape, or
+"error" (with a "message") for anything else.
+"""
+
+from memory import MemoryMappedIO, SegFault
+from instr_format import CondFlag
+from threaded import ThreadedCPU
+import objfile
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
+
+from typing import Dict, List
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Memory-mapped console addresses, as in duck_machine.py
+CONSOLE_IN = 510
+CONSOLE_OUT = 511
+
+
+class EndOfInput(Exception):
+    """The program read past the end of its input tape"""
+    pass
+
+
+def cli() -> object:
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(description="Duck Machine batch runner")
+    parser.add_argument("manifest", help="Jobs, one JSON object per line")
+    parser.add_argument("results", help="Results file to write")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument("--capacity", type=int, default=512,
+                        help="Memory capacity of each machine")
+    return parser.parse_args()
+
+
+def read_manifest(path: str) -> List[Dict]:
+    """Jobs from a manifest file.  Object file paths are
+    relative to the directory holding the manifest.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = [ ]
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            job["path"] = os.path.join(base, job["objfile"])
+            jobs.append(job)
+    return jobs
+
+
+def run_job(job: Dict, capacity: int=512) -> Dict:
+    """Run one job to completion.  Runs in a worker process."""
+    tape = iter(job.get("input", [ ]))
+    output = [ ]
+
+    def tape_in(addr: int) -> int:
+        for value in tape:
+            return value
+        raise EndOfInput()
+
+    def tape_out(addr: int, value: int) -> None:
+        output.append(value)
+
+    mem = MemoryMappedIO(capacity)
+    mem.map_address_in(CONSOLE_IN, tape_in)
+    mem.map_address_out(CONSOLE_OUT, tape_out)
+    cpu = ThreadedCPU(mem)
+    result = {"objfile": job["objfile"], "output": output}
+    try:
+        entry = objfile.load_program(job.get("path", job["objfile"]), mem)
+        cpu.run(from_addr=entry)
+        if cpu.condition is CondFlag.V:
+            result["halt"] = "overflow"
+        else:
+            result["halt"] = "halted"
+    except SegFault as e:
+        result["halt"] = "segfault"
+        result["message"] = str(e)
+    except EndOfInput:
+        result["halt"] = "end of input"
+    except Exception as e:
+        result["halt"] = "error"
+        result["message"] = f"{e.__class__.__name__}: {e}"
+    result["steps"] = cpu.step_count
+    return result
+
+
+def run_batch(jobs: List[Dict], workers: int=None,
+              capacity: int=512) -> List[Dict]:
+    """Run jobs across a pool of processes, returning
+    results in the same order as the jobs.
+    """
+    workers = workers or os.cpu_count()
+    # Several jobs per task keeps pickling overhead down for short jobs
+    chunk = max(1, len(jobs) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run_job, jobs, [capacity] * len(jobs),
+                             chunksize=chunk))
+
+
+def main():
+    args = cli()
+    jobs = read_manifest(args.manifest)
+    log.info(f"Running {len(jobs)} jobs on {args.jobs} workers")
+    results = run_batch(jobs, args.jobs, args.capacity)
+    with open(args.results, "w") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Benchmarks for the Duck Machine simulator.
+
+Each benchmark is a generated program, assembled and written as a
+text object file, then loaded and run on each CPU engine.  For
+each engine we report
+
+    load    seconds to load the object file and build the CPU
+    ips     instructions executed per second
+    mops    memory operations (LOAD and STORE) per second
+
+Results may be saved as JSON and compared with an earlier run, so
+that a change that slows the simulator down is noticed:
+
+    python bench.py -o before.json
+    ...change something...
+    python bench.py --compare before.json
+
+Timings are the best of several repetitions.
+"""
+
+from assembler import assemble
+from cpu import CPU
+from instr_format import OpCode
+from memory import MemoryMappedIO
+from profiler import Profiler
+from threaded import ThreadedCPU
+from blocks import BlockCPU
+import objfile
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+from typing import Callable, Dict, List
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+ENGINES = {"CPU": CPU, "ThreadedCPU": ThreadedCPU, "BlockCPU": BlockCPU}
+
+CONSOLE_IN = 510
+CONSOLE_OUT = 511
+
+# Slowdowns smaller than this fraction are treated as noise, as
+# are load time differences below LOAD_NOISE seconds
+THRESHOLD = 0.10
+LOAD_NOISE = 0.001
+
+
+def arith_loop(n: int) -> List[str]:
+    """Arithmetic in a tight loop, n iterations"""
+    return [
+        "   ADD  r1,r0,r0[1]",
+        "   LOAD r4,count",
+        "loop:",
+        "   ADD  r2,r2,r1[3]",
+        "   MUL  r3,r2,r0[5]",
+        "   SUB  r3,r3,r2[1]",
+        "   DIV  r3,r3,r0[2]",
+        "   SUB  r4,r4,r0[1]",
+        "   JUMP/P loop",
+        "   HALT r0,r0,r0",
+        f"count: DATA {n}",
+        ]
+
+
+def memcopy_loop(n: int) -> List[str]:
+    """Copy a 200-word block n times"""
+    return [
+        "   LOAD r5,passes",
+        "pass:",
+        "   ADD  r1,r0,r0[100]   # source",
+        "   ADD  r2,r0,r0[300]   # destination",
+        "   ADD  r4,r0,r0[200]   # words left",
+        "copy:",
+        "   LOAD  r3,r1,r0[0]",
+        "   STORE r3,r2,r0[0]",
+        "   ADD  r1,r1,r0[1]",
+        "   ADD  r2,r2,r0[1]",
+        "   SUB  r4,r4,r0[1]",
+        "   JUMP/P copy",
+        "   SUB  r5,r5,r0[1]",
+        "   JUMP/P pass",
+        "   HALT r0,r0,r0",
+        f"passes: DATA {n}",
+        ]
+
+
+def branchy_loop(n: int) -> List[str]:
+    """Data-dependent branches on i mod 3, n iterations"""
+    return [
+        "   LOAD r4,count",
+        "loop:",
+        "   DIV  r2,r4,r0[3]",
+        "   MUL  r2,r2,r0[3]",
+        "   SUB  r2,r4,r2       # i mod 3",
+        "   SUB  r0,r2,r0[1]",
+        "   JUMP/Z one",
+        "   JUMP/P two",
+        "   ADD  r5,r5,r0[1]",
+        "   JUMP next",
+        "one:",
+        "   ADD  r6,r6,r0[1]",
+        "   JUMP next",
+        "two:",
+        "   ADD/P r7,r7,r0[1]",
+        "next:",
+        "   SUB  r4,r4,r0[1]",
+        "   JUMP/P loop",
+        "   HALT r0,r0,r0",
+        f"count: DATA {n}",
+        ]
+
+
+def io_loop(n: int) -> List[str]:
+    """Read a value and write its double, n times"""
+    return [
+        "   LOAD r4,count",
+        "loop:",
+        f"   LOAD  r1,r0,r0[{CONSOLE_IN}]",
+        "   ADD   r1,r1,r1",
+        f"   STORE r1,r0,r0[{CONSOLE_OUT}]",
+        "   SUB  r4,r4,r0[1]",
+        "   JUMP/P loop",
+        "   HALT r0,r0,r0",
+        f"count: DATA {n}",
+        ]
+
+
+# Iterations of each program at scale 1
+PROGRAMS: Dict[str, Callable[[int], List[str]]] = {
+    "arith": arith_loop,
+    "memcopy": memcopy_loop,
+    "branchy": branchy_loop,
+    "io": io_loop,
+    }
+ITERATIONS = {"arith": 20000, "memcopy": 100, "branchy": 10000, "io": 20000}
+
+
+def console_memory() -> MemoryMappedIO:
+    """Memory with a console that reads 7s and discards output"""
+    mem = MemoryMappedIO(512)
+    mem.map_address_in(CONSOLE_IN, lambda addr: 7)
+    mem.map_address_out(CONSOLE_OUT, lambda addr, value: None)
+    return mem
+
+
+def count_memory_ops(path: str) -> int:
+    """LOADs and STOREs executed by the program, counted by a
+    profiled (untimed) run on the reference CPU
+    """
+    mem = console_memory()
+    cpu = CPU(mem)
+    profiler = Profiler(cpu)
+    cpu.run(from_addr=objfile.load_program(path, mem))
+    executed = 0
+    for addr, count in profiler.executed.items():
+        if profiler.instrs[addr].op in (OpCode.LOAD, OpCode.STORE):
+            executed += count - profiler.skipped[addr]
+    return executed
+
+
+def time_engine(engine: type, path: str, repeat: int) -> Dict:
+    """Best load and run times of repeat runs"""
+    best_load = best_run = float("inf")
+    steps = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        mem = console_memory()
+        entry = objfile.load_program(path, mem)
+        cpu = engine(mem)
+        loaded = time.perf_counter()
+        cpu.run(from_addr=entry)
+        done = time.perf_counter()
+        best_load = min(best_load, loaded - start)
+        best_run = min(best_run, done - loaded)
+        steps = cpu.step_count
+    return {"steps": steps, "load": best_load, "run": best_run}
+
+
+def run_benchmarks(scale: float=1.0, repeat: int=3,
+                   engines: List[str]=None) -> Dict:
+    """Results for each program and engine, ready to save as JSON"""
+    engines = engines or list(ENGINES)
+    results = { }
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, generate in PROGRAMS.items():
+            n = max(1, int(ITERATIONS[name] * scale))
+            path = os.path.join(tmp, f"{name}.obj")
+            with open(path, "w") as f:
+                for word in assemble(generate(n)):
+                    print(word, file=f)
+            mem_ops = count_memory_ops(path)
+            results[name] = { }
+            for engine in engines:
+                timing = time_engine(ENGINES[engine], path, repeat)
+                run = max(timing["run"], 1e-9)
+                timing["ips"] = timing["steps"] / run
+                timing["mops"] = mem_ops / run
+                results[name][engine] = timing
+                log.debug(f"{name} on {engine}: {timing}")
+    return {"commit": _commit(), "python": platform.python_version(),
+            "scale": scale, "results": results}
+
+
+def _commit() -> str:
+    """Current git commit, if we are in a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(run: Dict) -> str:
+    """Results as a table"""
+    lines = [f"{'program':<9} {'engine':<12} {'load ms':>8} {'steps':>9}"
+             + f" {'instr/s':>11} {'mem ops/s':>11}"]
+    for name, engines in run["results"].items():
+        for engine, r in engines.items():
+            lines.append(f"{name:<9} {engine:<12} {1000 * r['load']:>8.2f} {r['steps']:>9}"
+                         + f" {r['ips']:>11,.0f} {r['mops']:>11,.0f}")
+    return "\n".join(lines)
+
+
+def compare(previous: Dict, current: Dict, threshold: float=THRESHOLD) -> List[str]:
+    """Slowdowns of current relative to previous, greater than threshold"""
+    if previous.get("scale") != current.get("scale"):
+        log.warning("Runs were made at different scales")
+    slower = [ ]
+    for name, engines in current["results"].items():
+        for engine, r in engines.items():
+            before = previous["results"].get(name, {}).get(engine)
+            if before is None:
+                continue
+            for key in ["ips", "mops"]:
+                if r[key] < before[key] * (1 - threshold):
+                    slower.append(f"{name} on {engine}: {key} {before[key]:,.0f}"
+                                  + f" -> {r[key]:,.0f} ({r[key] / before[key] - 1:+.0%})")
+            if (r["load"] > before["load"] * (1 + threshold)
+                    and r["load"] - before["load"] > LOAD_NOISE):
+                slower.append(f"{name} on {engine}: load {1000 * before['load']:.2f}ms"
+                              + f" -> {1000 * r['load']:.2f}ms")
+    return slower
+
+
+def cli() -> object:
+    parser = argparse.ArgumentParser(description="Duck Machine benchmarks")
+    parser.add_argument("-o", "--output", help="Save results as JSON")
+    parser.add_argument("--compare", help="Earlier results (JSON) to compare with")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Multiply the work of each program")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Repetitions of each run (best is reported)")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="Report slowdowns larger than this fraction")
+    parser.add_argument("--engine", action="append", choices=list(ENGINES),
+                        help="Engine(s) to run (default all)")
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    current = run_benchmarks(args.scale, args.repeat, args.engine)
+    print(report(current))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        slower = compare(previous, current, args.threshold)
+        print()
+        print(f"Compared with {previous.get('commit')}: "
+              + ("\n  ".join(["slower"] + slower) if slower else "no slowdowns"))
+        if slower:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -78,6 +78,28 @@ class BitField(object):
         """
         return word | ((value & self.mask) << self.from_bit)
 
+    # Array versions of extract, extract_signed, and insert, for
+    # working on a whole object image at once.  They take NumPy
+    # arrays of words, which are treated as unsigned 32-bit
+    # integers.  NumPy is only needed if these are used.
 
+    def extract_array(self, words) -> "numpy.ndarray":
+        """Extract the bitfield from each word"""
+        import numpy as np
+        words = np.asarray(words).astype(np.uint32)
+        return (words >> self.from_bit) & self.mask
 
+    def extract_signed_array(self, words) -> "numpy.ndarray":
+        """Extract the bitfield from each word as a signed integer"""
+        import numpy as np
+        raw = self.extract_array(words).astype(np.int64)
+        sign_bit = 1 << (self.to_bit - self.from_bit)
+        # Flipping the sign bit and subtracting it sign extends
+        return (raw ^ sign_bit) - sign_bit
 
+    def insert_array(self, values, words) -> "numpy.ndarray":
+        """Insert each value into the corresponding word"""
+        import numpy as np
+        values = np.asarray(values).astype(np.int64) & self.mask
+        words = np.asarray(words).astype(np.uint32)
+        return words | (values << self.from_bit).astype(np.uint32)
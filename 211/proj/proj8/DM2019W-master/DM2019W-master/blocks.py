@@ -0,0 +1,256 @@
+"""
+Basic-block execution engine for the Duck Machine.
+
+DM2022 programs branch by writing r15 (pc), so we cannot know the
+control flow of a program before running it.  Instead, when
+execution reaches an address for the first time, we collect the
+basic block starting there:  the instructions up to and including
+the first one that may write r15 or HALT.  The block is translated
+into a single Python function that keeps registers in local
+variables, so a straight-line sequence of instructions runs without
+any per-instruction dispatch.
+
+Near the end of a max_steps budget, or for an instruction fetched
+from a memory-mapped I/O address, the engine falls back to single
+steps with the threaded engine.
+"""
+
+from instr_format import Instruction, OpCode, decode
+from memory import Memory
+from threaded import ThreadedCPU, compile_instr, COND, HALTED
+
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# State list slot in which a block reports how many of its
+# instructions completed before an exception (e.g., a SegFault)
+PARTIAL = 19
+
+# Longest block we compile, to bound the cost of a
+# recompile after a store into the block
+MAX_BLOCK = 64
+
+# A compiled block updates the state list and returns the
+# number of instructions it executed
+Block = Callable[[List[int]], int]
+
+FLAG = "2 if {0} == 0 else (4 if {0} > 0 else 1)"
+
+
+def ends_block(instr: Instruction) -> bool:
+    """Does instr (possibly) change control flow or halt?"""
+    if instr.cond.value == 0:
+        return False
+    if instr.op is OpCode.HALT:
+        return True
+    return instr.reg_target == 15 and instr.op is not OpCode.STORE
+
+
+def find_block(memory: Memory, start: int) -> List[Instruction]:
+    """The basic block beginning at start.  Empty if the word at
+    start is not an instruction or is a memory-mapped I/O address.
+    """
+    hooks = getattr(memory, "hooks_read", {})
+    # Compiling is not a fetch, so it does not count as a memory
+    # access.  peek skips I/O hooks, but we stop at hooked addresses.
+    peek = getattr(memory, "peek", memory.get)
+    instrs = [ ]
+    addr = start
+    while len(instrs) < MAX_BLOCK and 0 <= addr < memory.capacity:
+        if addr in hooks:
+            break
+        try:
+            instr = decode(peek(addr))
+        except ValueError:
+            break
+        instrs.append(instr)
+        if ends_block(instr):
+            break
+        addr += 1
+    return instrs
+
+
+class BlockTable(object):
+    """Compiled blocks by start address.  A block is forgotten
+    when any address it covers is written.
+    """
+
+    def __init__(self) -> None:
+        self.blocks: Dict[int, Tuple[Block, int]] = { }
+        self.covering: Dict[int, Set[int]] = { }
+
+    def get(self, start: int) -> Optional[Tuple[Block, int]]:
+        return self.blocks.get(start)
+
+    def add(self, start: int, block: Block, length: int) -> None:
+        self.blocks[start] = (block, length)
+        for addr in range(start, start + length):
+            self.covering.setdefault(addr, set()).add(start)
+
+    def pop(self, addr: int, default=None) -> None:
+        """Forget blocks that cover addr.  Named like dict.pop so
+        that threaded instructions can use a BlockTable as their
+        table of compiled code.
+        """
+        for start in self.covering.pop(addr, ()):
+            self.blocks.pop(start, None)
+
+
+def _operand(reg: int, addr: int) -> str:
+    """Expression for reading reg in the instruction at addr"""
+    if reg == 0:
+        return "0"
+    if reg == 15:
+        return str(addr)
+    return f"r{reg}"
+
+
+def block_source(start: int, instrs: List[Instruction]) -> str:
+    """Python source for a function executing the block"""
+    end = start + len(instrs) - 1
+    used = set()
+    written = set()
+    for instr in instrs:
+        used.update([instr.reg_target, instr.reg_src1, instr.reg_src2])
+        if instr.op is not OpCode.STORE:
+            written.add(instr.reg_target)
+    used = sorted(used - {0, 15})
+    written = sorted(written - {0, 15})
+    writeback = [f"regs[{reg}] = r{reg}" for reg in written]
+    writeback.append(f"regs[{COND}] = c")
+
+    def leave(indent: str, pc: str, count: int, halt: bool=False) -> List[str]:
+        lines = writeback + ([f"regs[{HALTED}] = 1"] if halt else [ ])
+        lines += [f"regs[15] = {pc}", f"return {count}"]
+        return [indent + line for line in lines]
+
+    body = [ ]
+    for index, instr in enumerate(instrs):
+        addr = start + index
+        count = index + 1
+        mask = instr.cond.value
+        if mask == 0:
+            continue
+        indent = "        "
+        body.append(f"{indent}# {addr}: {instr}")
+        if mask != 15:
+            body.append(f"{indent}if c & {mask}:")
+            indent += "    "
+        op = instr.op
+        target = instr.reg_target
+        left = _operand(instr.reg_src1, addr)
+        right = _operand(instr.reg_src2, addr)
+        offset = instr.offset
+        if op is OpCode.HALT:
+            body.append(f"{indent}c = 2")
+            body += leave(indent, str(addr + 1), count, halt=True)
+            continue
+        if op in (OpCode.LOAD, OpCode.STORE, OpCode.DIV):
+            # pc is kept up to date before each instruction that may
+            # raise an exception, e.g., a SegFault
+            body.append(f"{indent}pc = {addr + 1}")
+        if op is OpCode.DIV:
+            body.append(f"{indent}d = {right} + {offset}")
+            body.append(f"{indent}if d == 0:")
+            body.append(f"{indent}    c = 8")
+            if target not in (0, 15):
+                body.append(f"{indent}    r{target} = 0")
+            body += leave(indent + "    ", "0" if target == 15 else str(addr + 1),
+                          count, halt=True)
+            body.append(f"{indent}v = {left} // d")
+        else:
+            symbol = {OpCode.ADD: "+", OpCode.SUB: "-", OpCode.MUL: "*",
+                      OpCode.LOAD: "+", OpCode.STORE: "+"}[op]
+            body.append(f"{indent}v = {left} {symbol} ({right} + {offset})")
+        body.append(f"{indent}c = {FLAG.format('v')}")
+        if op is OpCode.LOAD:
+            body.append(f"{indent}v = get(v)")
+        elif op is OpCode.STORE:
+            body.append(f"{indent}put(v, {_operand(target, addr + 1)})")
+            body.append(f"{indent}if v in covering:")
+            body.append(f"{indent}    forget(v)")
+            if addr < end:
+                # Stored over an instruction later in this block
+                body.append(f"{indent}    if {addr} < v <= {end}:")
+                body += leave(indent + "        ", str(addr + 1), count)
+            continue
+        if target == 15:
+            body += leave(indent, "v", count)
+        elif target != 0:
+            body.append(f"{indent}r{target} = v")
+
+    lines = ["def block(regs):"]
+    lines += [f"    r{reg} = regs[{reg}]" for reg in used]
+    lines.append(f"    c = regs[{COND}]")
+    lines.append(f"    pc = {start}")
+    lines.append("    try:")
+    lines += body
+    lines += leave("        ", str(end + 1), len(instrs))
+    # Not BaseException:  after a KeyboardInterrupt, pc may be
+    # behind the registers, so none of them is written back
+    lines.append("    except Exception:")
+    lines += ["        " + line for line in writeback]
+    lines.append("        regs[15] = pc")
+    lines.append(f"        regs[{PARTIAL}] = pc - 1 - {start}")
+    lines.append("        raise")
+    return "\n".join(lines) + "\n"
+
+
+def compile_block(start: int, instrs: List[Instruction], memory: Memory,
+                  table: BlockTable) -> Block:
+    """Translate a basic block into a function"""
+    source = block_source(start, instrs)
+    log.debug(f"Block at {start}:\n{source}")
+    namespace = {"get": memory.get, "put": memory.put,
+                 "covering": table.covering, "forget": table.pop}
+    exec(compile(source, f"<block {start}>", "exec"), namespace)
+    return namespace["block"]
+
+
+class BlockCPU(ThreadedCPU):
+    """A CPU that runs whole basic blocks at a time.  Like
+    ThreadedCPU, it falls back to the reference CPU.step loop
+    when listeners are attached or in single step mode.
+    """
+
+    def _execute(self, regs: List[int], max_steps: int) -> None:
+        """Dispatch loop over compiled blocks"""
+        regs.append(0)  # PARTIAL
+        table = self._table()
+        steps = 0
+        try:
+            while not regs[HALTED] and steps < max_steps:
+                pc = regs[15]
+                entry = table.get(pc)
+                if entry is None:
+                    entry = self._compile(pc, table)
+                if entry is None or entry[1] > max_steps - steps:
+                    regs[PARTIAL] = 0
+                    self._single_step(pc, regs, table)
+                    steps += 1
+                else:
+                    steps += entry[0](regs)
+        except Exception:
+            steps += regs[PARTIAL]
+            raise
+        finally:
+            self.step_count = steps
+
+    def _new_table(self) -> BlockTable:
+        return BlockTable()
+
+    def _compile(self, pc: int, table: BlockTable) -> Optional[Tuple[Block, int]]:
+        instrs = find_block(self.memory, pc)
+        if not instrs:
+            return None
+        table.add(pc, compile_block(pc, instrs, self.memory, table), len(instrs))
+        return table.get(pc)
+
+    def _single_step(self, pc: int, regs: List[int], table: BlockTable) -> None:
+        """One instruction with the threaded engine"""
+        word = self.memory.get(pc)
+        compile_instr(pc, decode(word), self.memory, table)(regs)
@@ -0,0 +1,294 @@
+"""
+A cache between the CPU and memory.
+
+A Cache has the same interface as Memory, so a CPU can use it in
+place of its memory:
+
+    mem = MemoryMappedIO(512)
+    cpu = CPU(Cache(mem, size=64, line_size=4, ways=2))
+
+Memory is divided into lines of line_size consecutive words, and
+the cache holds size words:  size / (line_size * ways) sets of
+ways lines each.  ways=1 is a direct-mapped cache.  When a set is
+full, the least recently used line ("lru") or the line cached
+longest ("fifo") is evicted.
+
+With write_back=True, a write updates only the cached line, which
+is marked dirty and copied to memory when it is evicted (or on
+flush).  A write miss first reads the line into the cache.  With
+write_back=False (write-through), every write goes to memory, and
+a write miss does not bring the line into the cache.
+
+Addresses with memory-mapped I/O hooks are never cached.
+
+Each access is charged a simulated latency in cycles:  hit_time
+for a cache access, plus memory_time for each transfer between
+the cache and memory (reading or writing back a line, a
+write-through, or an uncached access).
+
+Listeners receive CacheHit, CacheMiss, and CacheEvict events, e.g.,
+so that the view can color cached cells, and MemoryRead and
+MemoryWrite events for uncached accesses.
+"""
+
+from memory import Memory, MemoryEvent, MemoryRead, MemoryWrite
+from mvc import MVCListenable
+
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+class CacheAccess(MemoryEvent):
+    """An access of a cacheable address.  The line holding it
+    covers addresses line .. line + size - 1, and cached tells
+    whether that line is in the cache after the access.
+    """
+    def __init__(self, subject: "Cache", addr: int, value: int,
+                 write: bool, line: int, size: int, cached: bool=True) -> None:
+        self.subject = subject
+        self.addr = addr
+        self.value = value
+        self.write = write
+        self.line = line
+        self.size = size
+        self.cached = cached
+
+class CacheHit(CacheAccess):
+    """The address was in the cache"""
+    pass
+
+class CacheMiss(CacheAccess):
+    """The address was not in the cache.  If the line was
+    brought into the cache, the event comes after it was.
+    """
+    pass
+
+class CacheEvict(MemoryEvent):
+    """The line covering addr .. addr + size - 1 left the cache"""
+    def __init__(self, subject: "Cache", addr: int, size: int) -> None:
+        self.subject = subject
+        self.addr = addr
+        self.size = size
+
+
+class Line(object):
+    """Cached copy of line_size words"""
+    __slots__ = ("words", "dirty")
+
+    def __init__(self, words: List[int]) -> None:
+        self.words = words
+        self.dirty = False
+
+
+class Cache(MVCListenable):
+    """A set-associative cache in front of backing memory"""
+
+    def __init__(self, backing: Memory, size: int=64, line_size: int=4,
+                 ways: int=1, policy: str="lru", write_back: bool=True,
+                 hit_time: int=1, memory_time: int=20) -> None:
+        super().__init__()
+        if policy not in ("lru", "fifo"):
+            raise ValueError(f"Unknown replacement policy '{policy}'")
+        if size % (line_size * ways):
+            raise ValueError("Cache size must be a multiple of line_size * ways")
+        self.backing = backing
+        self.capacity = backing.capacity
+        self.line_size = line_size
+        self.ways = ways
+        self.n_sets = size // (line_size * ways)
+        self.lru = policy == "lru"
+        self.write_back = write_back
+        self.hit_time = hit_time
+        self.memory_time = memory_time
+        # Each set maps line number to Line, oldest (or least
+        # recently used) first
+        self.sets: List[OrderedDict] = [OrderedDict() for _ in range(self.n_sets)]
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self.evictions = 0
+        self.writebacks = 0
+        self.cycles = 0
+
+    @property
+    def hooks_read(self) -> Dict:
+        return getattr(self.backing, "hooks_read", { })
+
+    @property
+    def hooks_write(self) -> Dict:
+        return getattr(self.backing, "hooks_write", { })
+
+    def _uncached(self, addr: int) -> bool:
+        return addr in self.hooks_read or addr in self.hooks_write
+
+    def _lookup(self, addr: int):
+        """The set and line number for addr, and the cached line if any"""
+        number = addr // self.line_size
+        cache_set = self.sets[number % self.n_sets]
+        line = cache_set.get(number)
+        if line is not None and self.lru:
+            cache_set.move_to_end(number)
+        return cache_set, number, line
+
+    def _fill(self, cache_set: OrderedDict, number: int) -> Line:
+        """Bring a line into the cache, evicting one if the set is full"""
+        if len(cache_set) >= self.ways:
+            old_number, old = cache_set.popitem(last=False)
+            self._evict(old_number, old)
+        start = number * self.line_size
+        end = min(start + self.line_size, self.capacity)
+        hooks = self.hooks_read
+        # Words with I/O hooks are never accessed through the line
+        words = [0 if addr in hooks else self.backing.get(addr)
+                 for addr in range(start, end)]
+        self.cycles += self.memory_time
+        line = Line(words)
+        cache_set[number] = line
+        return line
+
+    def _evict(self, number: int, line: Line) -> None:
+        self.evictions += 1
+        if line.dirty:
+            self._write_line(number, line)
+        if self.listeners:
+            self.notify_all(CacheEvict(self, number * self.line_size, self.line_size))
+
+    def _write_line(self, number: int, line: Line) -> None:
+        start = number * self.line_size
+        hooks = self.hooks_write
+        for addr, value in enumerate(line.words, start):
+            if addr not in hooks:
+                self.backing.put(addr, value)
+        line.dirty = False
+        self.writebacks += 1
+        self.cycles += self.memory_time
+
+    def _notify(self, hit: bool, addr: int, value: int, write: bool,
+                cached: bool=True) -> None:
+        event = CacheHit if hit else CacheMiss
+        start = addr - addr % self.line_size
+        self.notify_all(event(self, addr, value, write, start, self.line_size, cached))
+
+    def get(self, addr: int) -> int:
+        """Read a word through the cache"""
+        if addr < 0 or addr >= self.capacity or self._uncached(addr):
+            self.uncached += 1
+            self.cycles += self.memory_time
+            value = self.backing.get(addr)
+            if self.listeners:
+                self.notify_all(MemoryRead(self, addr, value))
+            return value
+        self.cycles += self.hit_time
+        cache_set, number, line = self._lookup(addr)
+        hit = line is not None
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+            line = self._fill(cache_set, number)
+        value = line.words[addr % self.line_size]
+        if self.listeners:
+            self._notify(hit, addr, value, False)
+        return value
+
+    def peek(self, addr: int) -> int:
+        """The word at addr, for tools such as a debugger:  no
+        events, no statistics, and no change to the cache
+        """
+        if 0 <= addr < self.capacity:
+            number = addr // self.line_size
+            line = self.sets[number % self.n_sets].get(number)
+            if line is not None:
+                return line.words[addr % self.line_size]
+        return self.backing.peek(addr)
+
+    def put(self, addr: int, value: int) -> None:
+        """Write a word through the cache"""
+        if addr < 0 or addr >= self.capacity or self._uncached(addr):
+            self.uncached += 1
+            self.cycles += self.memory_time
+            self.backing.put(addr, value)
+            if self.listeners:
+                self.notify_all(MemoryWrite(self, addr, value))
+            return
+        self.cycles += self.hit_time
+        cache_set, number, line = self._lookup(addr)
+        hit = line is not None
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+            if self.write_back:
+                line = self._fill(cache_set, number)
+        if self.write_back:
+            line.words[addr % self.line_size] = value
+            line.dirty = True
+        else:
+            self.backing.put(addr, value)
+            self.cycles += self.memory_time
+            if line is not None:
+                line.words[addr % self.line_size] = value
+        if self.listeners:
+            self._notify(hit, addr, value, True, line is not None)
+
+    def flush(self) -> None:
+        """Write all dirty lines back to memory"""
+        for cache_set in self.sets:
+            for number, line in cache_set.items():
+                if line.dirty:
+                    self._write_line(number, line)
+
+    def invalidate(self) -> None:
+        """Empty the cache, writing dirty lines back first"""
+        for cache_set in self.sets:
+            while cache_set:
+                self._evict(*cache_set.popitem(last=False))
+
+    def load_words(self, words: Iterable[int], start: int=0) -> None:
+        """Bulk load into memory, bypassing (and invalidating) the cache"""
+        self.invalidate()
+        self.backing.load_words(words, start)
+
+    def dump(self) -> Sequence[int]:
+        self.flush()
+        return self.backing.dump()
+
+    def segments(self) -> Iterable[Tuple[int, Sequence[int]]]:
+        self.flush()
+        return self.backing.segments()
+
+    def clear(self) -> None:
+        """Empty the cache, discarding dirty lines, and clear memory"""
+        for cache_set in self.sets:
+            cache_set.clear()
+        self.backing.clear()
+
+    def accesses(self) -> int:
+        return self.hits + self.misses + self.uncached
+
+    def hit_rate(self) -> float:
+        cached = self.hits + self.misses
+        return self.hits / cached if cached else 0.0
+
+    def report(self) -> str:
+        """Hit rate and simulated memory time"""
+        accesses = max(self.accesses(), 1)
+        policy = "LRU" if self.lru else "FIFO"
+        writes = "write-back" if self.write_back else "write-through"
+        size = self.n_sets * self.ways * self.line_size
+        return "\n".join([
+            f"Cache: {size} words, {self.line_size}-word lines, {self.ways}-way,"
+            + f" {policy}, {writes}",
+            f"{self.accesses()} accesses: {self.hits} hits, {self.misses} misses,"
+            + f" {self.uncached} uncached",
+            f"Hit rate {100 * self.hit_rate():.1f}%, {self.evictions} evictions,"
+            + f" {self.writebacks} line writes",
+            f"{self.cycles} cycles, {self.cycles / accesses:.2f} cycles per access"])
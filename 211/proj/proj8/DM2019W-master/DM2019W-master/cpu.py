@@ -5,13 +5,17 @@ Duck Machine model DM2022 CPU
 from instr_format import Instruction, OpCode, CondFlag, decode
 
 from memory import Memory
-from register import Register, ZeroRegister
+from register import RegisterFile
 from mvc import MVCEvent, MVCListenable
-from typing import Tuple
+from array import array
+from typing import Tuple, List, Optional, Sequence
+import struct
+import sys
+import zlib
 import logging
 logging.basicConfig()
 log = logging.getLogger(__name__)
-log.setLevel(logging.DEBUG)
+log.setLevel(logging.INFO)
 
 class ALU(object):
     """The arithmetic logic unit (also called a "functional unit"
@@ -58,6 +62,77 @@ class CPUStep(MVCEvent):
         self.instr_word = instr_word
         self.instr = instr
 
+class CPUPause(MVCEvent):
+    """CPU is about to wait for the user in single step mode,
+    after completing step_count steps.  A view should draw
+    everything it has pending.
+    """
+    def __init__(self, subject: "CPU", step_count: int) -> None:
+        self.subject = subject
+        self.step_count = step_count
+
+# Checkpoint header: magic, version, condition code, halted flag,
+# encoding, and memory capacity.  The body is a zlib-compressed
+# sequence of 64-bit little-endian words, or of zigzag varints (WIDE)
+# if some value does not fit in 64 bits:  the 16 registers, the
+# number of memory segments, and for each segment its start address,
+# its length, and its words.  Memory outside the segments is zero,
+# so a sparse PagedMemory saves only its allocated pages.
+CHECKPOINT_MAGIC = b"DKPT"
+CHECKPOINT_VERSION = 3
+CHECKPOINT_HEADER = struct.Struct("<4sBBBBI")
+NARROW = 0
+WIDE = 1
+
+
+def _encode_values(values) -> Tuple[int, bytes]:
+    """Encoding and bytes of a sequence of ints of any size"""
+    try:
+        words = array('q', values)
+    except OverflowError:
+        return WIDE, _encode_varints(values)
+    if sys.byteorder == "big":
+        words.byteswap()
+    return NARROW, words.tobytes()
+
+def _decode_values(encoding: int, data: bytes) -> Sequence[int]:
+    if encoding == WIDE:
+        return _decode_varints(data)
+    words = array('q')
+    words.frombytes(data)
+    if sys.byteorder == "big":
+        words.byteswap()
+    return words
+
+def _encode_varints(values) -> bytes:
+    """Zigzag (0, -1, 1, -2, ... as 0, 1, 2, 3, ...) then 7 bits
+    per byte, low bits first, high bit set on all but the last
+    """
+    out = bytearray()
+    for value in values:
+        value = 2 * value if value >= 0 else -2 * value - 1
+        while value >= 0x80:
+            out.append(value & 0x7F | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+def _decode_varints(data: bytes) -> List[int]:
+    values = [ ]
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            values.append(value >> 1 if not value & 1 else -(value >> 1) - 1)
+            value = shift = 0
+    return values
+
+# Destinations recorded in a trace (see tracing.py) for steps that
+# write no register
+TRACE_NO_DEST = -1   # STORE or HALT
+TRACE_SKIPPED = -2   # Predicated off
+
 class CPU(MVCListenable):
     """Duck Machine central processing unit (CPU)
     has 16 registers (including r0 that always holds zero
@@ -71,12 +146,11 @@ class CPU(MVCListenable):
     def __init__(self, memory: Memory):
         super().__init__()
         self.memory = memory  # Not part of CPU; what we really have is a connection
-        self.registers = [ ZeroRegister(), Register(), Register(), Register(),
-                           Register(), Register(), Register(), Register(),
-                           Register(), Register(), Register(), Register(),
-                           Register(), Register(), Register(), Register() ]
+        self.registers = RegisterFile(16)
         self.condition = CondFlag.ALWAYS
         self.halted = False
+        self.step_count = 0  # Steps completed by the latest run
+        self.trace = None  # A tracing.Trace to record steps in, if any
         self.alu = ALU()
         self.pc = self.registers[15]  # Alias to refer to program counter
 
@@ -84,10 +158,13 @@ class CPU(MVCListenable):
         """One fetch/decode/execute step"""
         # fetch - you must implement this part
         # Produce variables instr_addr and instr_word
-        instr_addr = self.pc.get()
+        regs = self.registers.values
+        instr_addr = regs[15]
         instr_word = self.memory.get(instr_addr)
         #
         # decode
+        # decode memoizes by word, so a store over an instruction
+        # (self-modifying code) is seen on the next fetch
         instr = decode(instr_word)
         # Convenient names for parts of instruction
         op = instr.op
@@ -95,45 +172,106 @@ class CPU(MVCListenable):
         reg_left = instr.reg_src1
         reg_right = instr.reg_src2
         offset = instr.offset
-        # Display the CPU state before executing instruction
-        self.notify_all(CPUStep(self, instr_addr, instr_word, instr))
+        # Display the CPU state before executing instruction.
+        # With no view attached, we skip building the event.
+        if self.listeners:
+            self.notify_all(CPUStep(self, instr_addr, instr_word, instr))
+        debug = log.isEnabledFor(logging.DEBUG)
         # execute (conditionally)
         enabled = self.condition & instr.cond
         if enabled:
             result, flag  = self.alu.exec(
                 instr.op,
-                self.registers[reg_left].get(),
-                self.registers[reg_right].get() + offset)
+                regs[reg_left],
+                regs[reg_right] + offset)
             self.condition = flag
             if self.condition == CondFlag.V:
                 self.halted = True
-            log.debug(f"ALU result of {instr.op}: {result}")
-        self.pc.put(self.pc.get() + 1)
+            if debug:
+                log.debug(f"ALU result of {instr.op}: {result}")
+        regs[15] = instr_addr + 1
+        # Destination register, memory address, and value for the trace
+        dest, addr, traced = TRACE_SKIPPED, 0, 0
         if enabled:
             if op == OpCode.STORE:
-                val = self.registers[reg_target].get()
-                log.debug(f"Storing {val} from {reg_target} into address {result}")
+                val = regs[reg_target]
+                if debug:
+                    log.debug(f"Storing {val} from {reg_target} into address {result}")
                 self.memory.put(result, val)
+                dest, addr, traced = TRACE_NO_DEST, result, val
             elif instr.op == OpCode.LOAD:
                 val = self.memory.get(result)
-                log.debug(f"Loaded value {val} from {result}, saving to register {reg_target}")
-                self.registers[reg_target].put(val)
+                if debug:
+                    log.debug(f"Loaded value {val} from {result}, saving to register {reg_target}")
+                regs[reg_target] = val
+                regs[0] = 0
+                dest, addr, traced = reg_target, result, val
             elif instr.op == OpCode.HALT:
                 self.halted = True
+                dest = TRACE_NO_DEST
             else:
-                log.debug(f"R{reg_target} = {instr.op}(R{reg_left}, R{reg_right}+ {offset})")
-                log.debug(f"Storing {result} into {reg_target}")
-                self.registers[reg_target].put(result)
+                if debug:
+                    log.debug(f"R{reg_target} = {instr.op}(R{reg_left}, R{reg_right}+ {offset})")
+                    log.debug(f"Storing {result} into {reg_target}")
+                regs[reg_target] = result
+                regs[0] = 0
+                dest, traced = reg_target, result
+        if self.trace is not None:
+            self.trace.record(instr_addr, instr_word, dest, addr, traced,
+                              self.condition.value)
 
-    def run(self, from_addr=0,  single_step=False) -> None:
-        """fetc/decode/execute loop until we HALT"""
+    def run(self, from_addr: Optional[int]=0, single_step=False,
+            max_steps: Optional[int]=None) -> None:
+        """fetc/decode/execute loop until we HALT, or until we have
+        taken max_steps steps.  If from_addr is None, execution
+        continues from the current program counter.
+        """
         self.halted = False
-        self.registers[15].put(from_addr)
-        step_count = 0
+        if from_addr is not None:
+            self.registers[15].put(from_addr)
+        self.step_count = 0
         while not self.halted:
+            if max_steps is not None and self.step_count >= max_steps:
+                break
             if single_step:
-                input(f"Step {step_count}; press enter")
+                if self.listeners:
+                    self.notify_all(CPUPause(self, self.step_count))
+                input(f"Step {self.step_count}; press enter")
             self.step()
-            step_count += 1
+            self.step_count += 1
 
+    def checkpoint(self) -> bytes:
+        """Registers, flags, and memory as a compact binary blob"""
+        values = list(self.registers.values)
+        segments = list(self.memory.segments())
+        values.append(len(segments))
+        for start, words in segments:
+            values += [start, len(words)]
+            values.extend(words)
+        encoding, data = _encode_values(values)
+        header = CHECKPOINT_HEADER.pack(
+            CHECKPOINT_MAGIC, CHECKPOINT_VERSION,
+            self.condition.value, self.halted, encoding,
+            self.memory.capacity)
+        return header + zlib.compress(data, 1)
 
+    def restore(self, blob: bytes) -> None:
+        """Return to the state saved by checkpoint"""
+        magic, version, condition, halted, encoding, capacity = \
+            CHECKPOINT_HEADER.unpack_from(blob)
+        if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION:
+            raise ValueError("Not a Duck Machine checkpoint")
+        if capacity != self.memory.capacity:
+            raise ValueError(f"Checkpoint of {capacity} words does not fit"
+                             + f" memory of {self.memory.capacity}")
+        values = _decode_values(encoding, zlib.decompress(blob[CHECKPOINT_HEADER.size:]))
+        self.memory.clear()
+        pos = 17
+        for _ in range(values[16]):
+            start, length = values[pos], values[pos + 1]
+            self.memory.load_words(values[pos + 2:pos + 2 + length], start)
+            pos += 2 + length
+        for reg, value in zip(self.registers, values[:16]):
+            reg.put(value)
+        self.condition = CondFlag(condition)
+        self.halted = bool(halted)
@@ -0,0 +1,238 @@
+"""
+A debugger for Duck Machine programs.
+
+Breakpoints and watchpoints cost nothing except where they are
+set, so a program runs at the speed of the threaded engine up to
+the point of interest:
+
+  - A breakpoint is a trap in the threaded code table, in place of
+    the compiled instruction at its address.  When execution
+    reaches it, the trap raises BreakpointHit before the
+    instruction executes.
+  - A watchpoint is a memory-mapped I/O hook on each watched
+    address, chained to any hook already there (e.g., the
+    console).  It lets the access happen, then asks the CPU to
+    stop after the current instruction.
+
+Example:
+
+    mem = MemoryMappedIO(512)
+    ...load a program...
+    debug = Debugger(ThreadedCPU(mem))
+    debug.add_breakpoint(12)
+    debug.watch(30, 32, read=False)
+    stop = debug.cont()      # Stop(reason="breakpoint", addr=12, ...)
+    debug.step(3)
+    print(debug.state())
+
+If listeners (e.g., a view) or a trace are attached, the CPU
+cannot use threaded code, and the debugger steps with CPU.step,
+checking breakpoints itself.
+"""
+
+from instr_format import decode
+from memory import MemoryMappedIO
+from threaded import ThreadedCPU
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+class BreakpointHit(Exception):
+    """Raised by a breakpoint trap to leave the dispatch loop"""
+    def __init__(self, addr: int) -> None:
+        super().__init__(f"Breakpoint at {addr}")
+        self.addr = addr
+
+
+class Stop(NamedTuple):
+    """Why the debugger returned control.  reason is "breakpoint",
+    "read" or "write" (a watchpoint), "halted", or "steps" (the
+    requested number of steps were taken).  addr is the breakpoint
+    or watched address, and value the word read or written.
+    """
+    reason: str
+    addr: Optional[int] = None
+    value: Optional[int] = None
+
+
+class Debugger(object):
+    """Controls a ThreadedCPU.  (A BlockCPU checks for breakpoints
+    and stop requests only between blocks, so it is not suitable.)
+    """
+
+    def __init__(self, cpu: ThreadedCPU) -> None:
+        self.cpu = cpu
+        self.memory: MemoryMappedIO = cpu.memory
+        self.breakpoints = set()
+        # Hooks replaced by watchpoints, to chain to and to restore
+        self._read_watched: Dict[int, Optional[Callable]] = { }
+        self._write_watched: Dict[int, Optional[Callable]] = { }
+        self._stop: Optional[Stop] = None
+        self.steps = 0   # Total steps taken under the debugger
+
+    # Breakpoints
+
+    def add_breakpoint(self, addr: int) -> None:
+        def trap(regs: List[int]) -> None:
+            raise BreakpointHit(addr)
+        self.breakpoints.add(addr)
+        self.cpu.traps[addr] = trap
+
+    def remove_breakpoint(self, addr: int) -> None:
+        self.breakpoints.discard(addr)
+        self.cpu.traps.pop(addr, None)
+
+    # Watchpoints
+
+    def watch(self, start: int, end: int=None, read: bool=True,
+              write: bool=True) -> None:
+        """Stop after any access to addresses start..end-1
+        (just start if end is omitted).  Reads include fetching
+        an instruction.
+        """
+        if end is None:
+            end = start + 1
+        memory = self.memory
+        for addr in range(start, end):
+            if read and addr not in self._read_watched:
+                previous = memory.hooks_read.get(addr)
+                self._read_watched[addr] = previous
+                memory.hooks_read[addr] = self._read_hook(previous)
+            if write and addr not in self._write_watched:
+                previous = memory.hooks_write.get(addr)
+                self._write_watched[addr] = previous
+                memory.hooks_write[addr] = self._write_hook(previous)
+
+    def unwatch(self, start: int, end: int=None) -> None:
+        """Remove watchpoints, restoring the hooks they replaced"""
+        if end is None:
+            end = start + 1
+        for watched, hooks in [(self._read_watched, self.memory.hooks_read),
+                               (self._write_watched, self.memory.hooks_write)]:
+            for addr in range(start, end):
+                if addr not in watched:
+                    continue
+                previous = watched.pop(addr)
+                if previous is None:
+                    del hooks[addr]
+                else:
+                    hooks[addr] = previous
+
+    def _read_hook(self, previous: Optional[Callable[[int], int]]) -> Callable[[int], int]:
+        memory = self.memory
+
+        def read(addr: int) -> int:
+            if previous is None:
+                value = super(MemoryMappedIO, memory).get(addr)
+            else:
+                value = previous(addr)
+            self._request_stop(Stop("read", addr, value))
+            return value
+        return read
+
+    def _write_hook(self, previous: Optional[Callable[[int, int], None]]) -> Callable[[int, int], None]:
+        memory = self.memory
+
+        def write(addr: int, value: int) -> None:
+            if previous is None:
+                super(MemoryMappedIO, memory).put(addr, value)
+            else:
+                previous(addr, value)
+            self._request_stop(Stop("write", addr, value))
+        return write
+
+    def _request_stop(self, stop: Stop) -> None:
+        if self._stop is None:
+            self._stop = stop
+        self.cpu.request_stop()
+
+    # Execution
+
+    def cont(self, max_steps: int=None) -> Stop:
+        """Run until a breakpoint, a watchpoint, HALT, or max_steps.
+        A breakpoint at the current pc does not stop execution again.
+        """
+        if max_steps == 0:
+            return Stop("steps")
+        pc = self.cpu.registers[15].get()
+        if pc in self.breakpoints:
+            stop = self._run(1, skip=pc)
+            if stop.reason != "steps" or max_steps == 1:
+                return stop
+            if max_steps is not None:
+                max_steps -= 1
+        return self._run(max_steps)
+
+    def step(self, count: int=1) -> Stop:
+        """Execute count instructions, stopping early as cont does"""
+        return self.cont(count)
+
+    def _run(self, max_steps: Optional[int], skip: int=None) -> Stop:
+        """Run, with the breakpoint (if any) at address skip disabled"""
+        cpu = self.cpu
+        self._stop = None
+        trap = cpu.traps.pop(skip, None) if skip is not None else None
+        try:
+            if cpu._can_thread():
+                try:
+                    cpu.run(from_addr=None, max_steps=max_steps)
+                except BreakpointHit as e:
+                    self._stop = Stop("breakpoint", e.addr)
+                finally:
+                    self.steps += cpu.step_count
+            else:
+                self._step_reference(max_steps, skip)
+        finally:
+            if trap is not None:
+                cpu.traps[skip] = trap
+        if self._stop is not None:
+            return self._stop
+        if cpu.halted:
+            return Stop("halted")
+        return Stop("steps")
+
+    def _step_reference(self, max_steps: Optional[int], skip: int=None) -> None:
+        """Run with CPU.step, checking breakpoints before each step"""
+        cpu = self.cpu
+        cpu.halted = False
+        cpu.stop_requested = False
+        taken = 0
+        while not cpu.halted and not cpu.stop_requested:
+            if max_steps is not None and taken >= max_steps:
+                break
+            pc = cpu.registers[15].get()
+            if pc in self.breakpoints and pc != skip:
+                self._stop = Stop("breakpoint", pc)
+                break
+            skip = None
+            cpu.step()
+            taken += 1
+            self.steps += 1
+
+    # Inspection
+
+    def state(self) -> Dict:
+        """Registers, condition code, and the next instruction"""
+        cpu = self.cpu
+        pc = cpu.registers[15].get()
+        try:
+            instr = str(decode(self.memory.peek(pc)))
+        except Exception as e:
+            instr = f"({e.__class__.__name__})"
+        return {"pc": pc,
+                "registers": [reg.get() for reg in cpu.registers],
+                "condition": str(cpu.condition),
+                "halted": cpu.halted,
+                "steps": self.steps,
+                "next": instr}
+
+    def words(self, start: int, end: int) -> List[Tuple[int, int]]:
+        """(address, word) pairs for start..end-1, without
+        triggering hooks, watchpoints, or listeners
+        """
+        return [(addr, self.memory.peek(addr)) for addr in range(start, end)]
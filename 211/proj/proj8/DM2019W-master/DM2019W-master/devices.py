@@ -0,0 +1,117 @@
+"""
+Buffered devices for memory-mapped I/O.
+
+The console hooks in duck_machine.py prompt for and print one
+value per LOAD or STORE, so the simulation waits on every console
+round trip.  An InputDevice is instead backed by a queue that a
+producer thread keeps filled, so a read blocks only when no input
+is buffered yet.  An OutputDevice collects values and passes them
+to its sink in batches.
+"""
+
+from memory import MemoryMappedIO
+
+import queue
+import sys
+import threading
+
+from typing import Callable, Iterable, List, TextIO
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Queued after the last input value
+_END = object()
+
+
+class InputDevice(object):
+    """An input port.  Values may come from a source iterable,
+    read ahead by a producer thread, or be fed by any thread.
+    """
+
+    def __init__(self, source: Iterable[int]=None, buffer_size: int=1024) -> None:
+        self.queue = queue.Queue(maxsize=buffer_size)
+        if source is not None:
+            self.start(source)
+
+    def start(self, source: Iterable[int]) -> None:
+        """Read ahead from source in a background thread,
+        closing the device when source is exhausted.
+        """
+        def produce():
+            try:
+                for value in source:
+                    self.queue.put(value)
+            finally:
+                self.close()
+        threading.Thread(target=produce, daemon=True).start()
+
+    def feed(self, values: Iterable[int]) -> None:
+        for value in values:
+            self.queue.put(value)
+
+    def close(self) -> None:
+        """No more input will follow"""
+        self.queue.put(_END)
+
+    def read(self, addr: int) -> int:
+        """Memory read hook.  Raises EOFError after the last value."""
+        value = self.queue.get()
+        if value is _END:
+            self.queue.put(_END)  # Later reads fail too
+            raise EOFError("No more input")
+        return value
+
+
+class OutputDevice(object):
+    """An output port that passes values to sink in batches"""
+
+    def __init__(self, sink: Callable[[List[int]], None],
+                 batch_size: int=256) -> None:
+        self.sink = sink
+        self.batch_size = batch_size
+        self.buffer: List[int] = [ ]
+
+    def write(self, addr: int, value: int) -> None:
+        """Memory write hook"""
+        self.buffer.append(value)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Pass along everything written so far"""
+        if self.buffer:
+            batch, self.buffer = self.buffer, [ ]
+            self.sink(batch)
+
+
+def attach(memory: MemoryMappedIO, device_in: InputDevice,
+           device_out: OutputDevice, in_addr: int=510,
+           out_addr: int=511) -> None:
+    """Map the devices to addresses of memory"""
+    memory.map_address_in(in_addr, device_in.read)
+    memory.map_address_out(out_addr, device_out.write)
+
+
+def read_ints(file: TextIO) -> Iterable[int]:
+    """Integers from file, one per non-blank line.  Other lines
+    are reported and skipped.
+    """
+    for line_num, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            yield int(line)
+        except ValueError:
+            log.warning(f"Input line {line_num} is not an integer: {line.strip()!r}")
+
+
+def console_devices(batch_size: int=256):
+    """Buffered input from stdin and output to stdout"""
+    def print_batch(values: List[int]) -> None:
+        sys.stdout.write("".join(f"Quack!: {value}\n" for value in values))
+        sys.stdout.flush()
+    return (InputDevice(read_ints(sys.stdin)),
+            OutputDevice(print_batch, batch_size))
@@ -0,0 +1,352 @@
+"""
+Differential testing of Duck Machine engines against CPU.step.
+
+An engine (ThreadedCPU, BlockCPU, or any other CPU subclass) must
+leave exactly the state that the reference CPU.step would.  We run
+a program on both, the engine in slices of `stride` steps with
+run(from_addr=None, max_steps=stride), and after each slice compare
+
+    registers, condition code, and halted flag,
+    the memory writes (address, value) made during the slice, and
+    the exception raised, if the slice ended in a fault.
+
+Stride 1 compares after every instruction.  Longer strides let an
+engine run several instructions at once, e.g., a whole basic block.
+
+Programs are random (from a seeded generator, so a run is
+repeatable) or the object files in programs/, fed a fixed input
+tape.  When a program fails, it is shrunk to a minimal
+counterexample:  we drop words and simplify instructions as long
+as the mismatch remains.
+
+    python difftest.py --engine BlockCPU --count 1000 --seed 7
+"""
+
+from cpu import CPU
+from instr_format import Instruction, OpCode, CondFlag, decode
+from memory import MemoryMappedIO
+from threaded import ThreadedCPU
+from blocks import BlockCPU
+import objfile
+
+import argparse
+import glob
+import os
+import random
+
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+ENGINES = {"ThreadedCPU": ThreadedCPU, "BlockCPU": BlockCPU}
+
+CONSOLE_IN = 510
+CONSOLE_OUT = 511
+CAPACITY = 512
+
+MAX_STEPS = 200
+STRIDES = (1, 16, MAX_STEPS)
+
+# Input tape for corpus programs; reads past its end return 0
+TAPE = (5, 3, 7, 0)
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "programs")
+
+Write = Tuple[int, int]
+
+
+class LoggedMemory(MemoryMappedIO):
+    """Memory that keeps a log of every write, including writes
+    to the console.  It has no listeners, so an engine uses its
+    fast path on it.
+    """
+
+    def __init__(self, capacity: int=CAPACITY, tape: Sequence[int]=TAPE) -> None:
+        super().__init__(capacity)
+        self.writes: List[Write] = [ ]
+        inputs = iter(tape)
+        self.map_address_in(CONSOLE_IN, lambda addr: next(inputs, 0))
+        self.map_address_out(CONSOLE_OUT, lambda addr, value: None)
+
+    def put(self, index: int, value: int) -> None:
+        self.writes.append((index, value))
+        super().put(index, value)
+
+
+class Case(NamedTuple):
+    """A program loaded at address 0, run from entry for at most
+    max_steps steps, reading console input from tape
+    """
+    words: Tuple[int, ...]
+    entry: int = 0
+    max_steps: int = MAX_STEPS
+    tape: Tuple[int, ...] = TAPE
+    name: str = "random"
+
+
+class State(NamedTuple):
+    """Machine state at a comparison point.  writes are those made
+    since the previous comparison point.
+    """
+    steps: int
+    registers: Tuple[int, ...]
+    condition: CondFlag
+    halted: bool
+    writes: Tuple[Write, ...]
+    fault: Optional[str] = None
+
+
+class Mismatch(NamedTuple):
+    """The first point at which an engine differed from CPU.step"""
+    case: Case
+    engine: type
+    stride: int
+    expected: State
+    actual: State
+
+    def __str__(self) -> str:
+        lines = [f"{self.engine.__name__} (stride {self.stride}) differs from CPU.step"
+                 + f" on {self.case.name} program, {len(self.case.words)} words,"
+                 + f" entry {self.case.entry}, at most {self.case.max_steps} steps:"]
+        for addr, word in enumerate(self.case.words):
+            lines.append(f"{addr:>5}: {word:>12}  {disassemble(word)}")
+        for field in State._fields:
+            expected = getattr(self.expected, field)
+            actual = getattr(self.actual, field)
+            marker = "  " if expected == actual else "* "
+            lines.append(f"{marker}{field:<10} expected {expected}")
+            if expected != actual:
+                lines.append(f"  {'':<10} actual   {actual}")
+        return "\n".join(lines)
+
+
+def disassemble(word: int) -> str:
+    try:
+        return str(decode(word))
+    except ValueError:
+        return "(data)"
+
+
+def _snapshot(cpu: CPU, steps: int, writes: List[Write], since: int,
+              fault: Optional[Exception]=None) -> State:
+    return State(steps, tuple(cpu.registers.values), cpu.condition, cpu.halted,
+                 tuple(writes[since:]),
+                 None if fault is None else fault.__class__.__name__)
+
+
+def _start(engine: type, case: Case) -> CPU:
+    memory = LoggedMemory(tape=case.tape)
+    memory.load_words(case.words)
+    cpu = engine(memory)
+    cpu.registers[15].put(case.entry)
+    return cpu
+
+
+def _run(cpu: CPU, max_steps: int, stride: int) -> Iterator[State]:
+    """Run in slices of stride steps, generating the state after
+    each slice, until HALT, a fault, or max_steps steps
+    """
+    writes = cpu.memory.writes
+    steps = 0
+    while steps < max_steps:
+        since = len(writes)
+        try:
+            cpu.run(from_addr=None, max_steps=min(stride, max_steps - steps))
+        except Exception as e:
+            yield _snapshot(cpu, steps + cpu.step_count, writes, since, e)
+            return
+        steps += cpu.step_count
+        yield _snapshot(cpu, steps, writes, since)
+        if cpu.halted:
+            return
+
+
+def reference(case: Case) -> Tuple[List[State], Optional[State]]:
+    """States of CPU.step after 0, 1, 2, ... steps, and the state
+    after a fault (in the step following the last), if any
+    """
+    cpu = _start(CPU, case)
+    states = [_snapshot(cpu, 0, [ ], 0)]
+    for state in _run(cpu, case.max_steps, 1):
+        if state.fault is not None:
+            return states, state
+        states.append(state)
+    return states, None
+
+
+def compare(case: Case, engine: type, stride: int=1,
+            expected: Tuple[List[State], Optional[State]]=None) -> Optional[Mismatch]:
+    """The first difference between engine and CPU.step, if any.
+    expected is the reference run of case, if already known.
+    """
+    states, fault = expected or reference(case)
+    # All writes of the reference run, and how many were made
+    # by the end of each step
+    writes: List[Write] = [ ]
+    made = [ ]
+    for state in states:
+        writes.extend(state.writes)
+        made.append(len(writes))
+    if fault is not None:
+        writes.extend(fault.writes)
+    last = len(states) - 1
+    before = 0    # Steps completed at the previous comparison
+    for actual in _run(_start(engine, case), case.max_steps, stride):
+        steps = actual.steps
+        if fault is not None and (steps > last or actual.fault is not None and steps == last):
+            want = fault._replace(writes=tuple(writes[made[before]:]))
+        else:
+            steps = min(steps, last)
+            want = states[steps]._replace(writes=tuple(writes[made[before]:made[steps]]))
+        if actual != want:
+            return Mismatch(case, engine, stride, want, actual)
+        before = steps
+    return None
+
+
+def check(cases: Iterator[Case], engine: type,
+          strides: Sequence[int]=STRIDES) -> Optional[Mismatch]:
+    """The first mismatch of engine on any case, at any stride"""
+    for case in cases:
+        expected = reference(case)
+        for stride in strides:
+            mismatch = compare(case, engine, stride, expected)
+            if mismatch is not None:
+                return mismatch
+    return None
+
+
+# Random programs
+
+REGISTERS = [0, 1, 2, 3, 15]
+CONDITIONS = [CondFlag.ALWAYS] * 6 + [
+    CondFlag.M, CondFlag.Z, CondFlag.P, CondFlag.V,
+    CondFlag.M | CondFlag.Z, CondFlag.Z | CondFlag.P, CondFlag.NEVER]
+OPS = [OpCode.ADD] * 3 + [OpCode.SUB, OpCode.MUL, OpCode.DIV,
+                          OpCode.LOAD, OpCode.STORE, OpCode.HALT]
+
+
+def random_word(rng: random.Random) -> int:
+    """Mostly instructions on a few registers with small offsets,
+    so that loads, stores, and jumps usually stay in the program
+    """
+    if rng.random() < 0.1:
+        return rng.randint(-50, 50)
+    return Instruction(rng.choice(OPS), rng.choice(CONDITIONS),
+                       rng.choice(REGISTERS), rng.choice(REGISTERS),
+                       rng.choice(REGISTERS), rng.randint(-8, 12)).encode()
+
+
+def random_cases(count: int, seed: int=0, length: int=30) -> Iterator[Case]:
+    """count random programs of 1 to length words"""
+    rng = random.Random(seed)
+    for index in range(count):
+        words = [random_word(rng) for _ in range(rng.randint(1, length))]
+        yield Case(tuple(words), name=f"random #{index} (seed {seed})")
+
+
+def corpus_cases(directory: str=CORPUS) -> Iterator[Case]:
+    """The text object files in directory"""
+    for path in sorted(glob.glob(os.path.join(directory, "*.obj"))):
+        with open(path) as f:
+            words = objfile.read_text(f)
+        yield Case(tuple(words), name=os.path.basename(path))
+
+
+# Shrinking
+
+def _simpler_words(word: int) -> Iterator[int]:
+    """Words like word but simpler, simplest first"""
+    try:
+        instr = decode(word)
+    except ValueError:
+        yield 0
+        if word // 2 != word:
+            yield word // 2
+        return
+    fields = [instr.op, instr.cond, instr.reg_target,
+              instr.reg_src1, instr.reg_src2, instr.offset]
+    simpler = [OpCode.ADD, CondFlag.ALWAYS, None, 0, 0, 0]
+    for index, value in enumerate(simpler):
+        if value is not None and fields[index] != value:
+            yield Instruction(*fields[:index], value, *fields[index + 1:]).encode()
+    if instr.offset not in (0, int(instr.offset / 2)):
+        yield Instruction(*fields[:5], int(instr.offset / 2)).encode()
+
+
+def _smaller_cases(case: Case, steps: int) -> Iterator[Case]:
+    """Cases like case but smaller, most reduction first"""
+    if steps < case.max_steps:
+        yield case._replace(max_steps=steps)
+    words = case.words
+    for index in reversed(range(len(words))):
+        entry = case.entry - (case.entry > index)
+        yield case._replace(words=words[:index] + words[index + 1:], entry=entry)
+    for index in range(len(case.tape)):
+        yield case._replace(tape=case.tape[:index] + case.tape[index + 1:])
+    for index, word in enumerate(words):
+        for simpler in _simpler_words(word):
+            yield case._replace(words=words[:index] + (simpler,) + words[index + 1:])
+
+
+def shrink(mismatch: Mismatch, limit: int=1000) -> Mismatch:
+    """A minimal counterexample:  no single word can be removed
+    or simplified with the engine still differing from CPU.step.
+    Tries at most limit smaller cases.
+    """
+    tried = 0
+    progress = True
+    while progress and tried < limit:
+        progress = False
+        steps = max(mismatch.expected.steps, mismatch.actual.steps, 1)
+        for case in _smaller_cases(mismatch.case, steps):
+            tried += 1
+            smaller = compare(case, mismatch.engine, mismatch.stride)
+            if smaller is not None:
+                mismatch = smaller
+                progress = True
+                break
+            if tried >= limit:
+                break
+    return mismatch
+
+
+def cli() -> object:
+    parser = argparse.ArgumentParser(description="Compare engines with CPU.step")
+    parser.add_argument("--engine", action="append", choices=list(ENGINES),
+                        help="Engine(s) to test (default all)")
+    parser.add_argument("--count", type=int, default=500,
+                        help="Number of random programs")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the random programs")
+    parser.add_argument("--length", type=int, default=30,
+                        help="Longest random program, in words")
+    parser.add_argument("--no-corpus", action="store_true",
+                        help="Skip the programs/ directory")
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    failed = False
+    for name in args.engine or list(ENGINES):
+        engine = ENGINES[name]
+        cases = random_cases(args.count, args.seed, args.length)
+        mismatch = check(cases, engine)
+        if mismatch is None and not args.no_corpus:
+            mismatch = check(corpus_cases(), engine)
+        if mismatch is None:
+            print(f"{name}: no differences")
+            continue
+        failed = True
+        log.info(f"{name} differs on {mismatch.case.name}; shrinking")
+        print(shrink(mismatch))
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
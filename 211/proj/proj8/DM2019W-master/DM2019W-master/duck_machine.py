@@ -5,14 +5,19 @@ a simulated computer.
 Interprets Duck Machine object code. 
 """
 
-from memory import Memory, MemoryMappedIO
+from memory import MemoryMappedIO
 from cpu import CPU
+from profiler import Profiler
+from pipeline import Pipeline
+import devices
+import objfile
+from cache import Cache
+import tracing
 
 import view
 
 import argparse
 import sys
-import io
 
 from typing import List, Tuple
 
@@ -25,22 +30,31 @@ log.setLevel(logging.INFO)
 def cli() -> object:
     """Get arguments from command line"""
     parser = argparse.ArgumentParser(description="Duck Machine Simulator")
-    parser.add_argument("objfile", type=argparse.FileType('r'),
-                            help="Object file input")
+    parser.add_argument("objfile",
+                            help="Object file input (.obj text or .dobj binary)")
     parser.add_argument("-d", "--display", help="Graphical display",
                         action="store_true")
     parser.add_argument("-s", "--step", help="Single step mode",
                         action="store_true")
+    parser.add_argument("-b", "--buffered",
+                        help="Buffered console I/O: read input ahead from stdin, print output in batches",
+                        action="store_true")
+    parser.add_argument("-p", "--profile", help="Report execution hot spots",
+                        action="store_true")
+    parser.add_argument("--pipeline", help="Report cycles per instruction of a pipelined core",
+                        action="store_true")
+    parser.add_argument("-c", "--cache", help="Run through a cache and report hit rate",
+                        action="store_true")
+    parser.add_argument("-t", "--trace", type=argparse.FileType("wb"),
+                        help="Write a trace of the last steps to this file")
     args = parser.parse_args()
+    if args.buffered and (args.step or args.display):
+        # The read-ahead thread would consume the lines typed at
+        # their prompts
+        parser.error("--buffered reads ahead from stdin, so it cannot"
+                     + " be combined with --step or --display")
     return args
 
-def load(file: io.IOBase, memory: Memory) -> None:
-    addr = 0
-    for line in file:
-        word = int(line)
-        memory.put(addr, word)
-        addr += 1
-
 def duck_out(addr: int, value: int) -> None:
     print("Quack!: {}".format(value))
 
@@ -59,14 +73,46 @@ def main():
     # For that, maximum positive value is 511.  We'll
     # reserve addresses 510 and 511 for input and output
     # respectively.
-    mem.map_address_in(510,duck_in)
-    mem.map_address_out(511,duck_out)
-    cpu = CPU(mem)
+    if args.buffered:
+        console_in, console_out = devices.console_devices()
+        devices.attach(mem, console_in, console_out, 510, 511)
+    else:
+        mem.map_address_in(510,duck_in)
+        mem.map_address_out(511,duck_out)
+    if args.cache:
+        cache = Cache(mem)
+        cpu = CPU(cache)
+    else:
+        cpu = CPU(mem)
     if args.display: 
        display = view.MachineStateView(cpu,1200,800)
-    load(args.objfile, mem)
-    cpu.run(single_step=args.step)
+    if args.profile:
+        profiler = Profiler(cpu)
+    if args.pipeline:
+        pipeline = Pipeline(cpu)
+    if args.trace:
+        cpu.trace = tracing.Trace()
+    entry = objfile.load_program(args.objfile, mem)
+    try:
+        cpu.run(from_addr=entry, single_step=args.step)
+    except EOFError:
+        print("Quack! Ran out of input")
+        raise SystemExit(1)
+    finally:
+        if args.buffered:
+            console_out.flush()
+        if args.trace:
+            cpu.trace.write(args.trace)
+            args.trace.close()
+    if args.display:
+        display.refresh()
     print("Halted")
+    if args.profile:
+        print(profiler.report())
+    if args.pipeline:
+        print(pipeline.report())
+    if args.cache:
+        print(cache.report())
     if args.display:
       input("Press enter to end")
 
@@ -2,6 +2,8 @@
 
 from bitfield import BitField
 from enum import Enum, Flag
+from typing import Dict, Iterable, List
+import functools
 
 # The field bit positions
 reserved = BitField(31,31)  # negative or nah
@@ -42,6 +44,10 @@ class CondFlag(Flag):
     ALWAYS = M | Z | P | V
 
     def __str__(self):
+        """Name of the combination, from a table built once"""
+        return _COND_NAMES[self.value]
+
+    def _name(self) -> str:
         """If the exact combination has a name, we return that.
         Otherwise, we combine bits, e.g., ZP for non-negative.
         """
@@ -58,6 +64,15 @@ class CondFlag(Flag):
                 bits.append(i.name)
         return "".join(bits)
 
+# Lookup tables indexed by field value, so that decoding does not
+# go through the (slow) enum constructors.  Unused operation codes
+# are None.
+_OPCODES = 32 * [ None ]
+for _op in OpCode:
+    _OPCODES[_op.value] = _op
+_CONDS = [ CondFlag(value) for value in range(16) ]
+_COND_NAMES = [ cond._name() for cond in _CONDS ]
+
 # Registers are numbered from 0 to 15, and have names
 # like r3, r15, etc.  Two special registers have additional
 # names:  r0 is called 'zero' because on the DM2022 it always
@@ -79,21 +94,47 @@ NAMED_REGS = {
 #
 class Instruction(object):
     """An instruction is made up of several fields, which
-    are represented here as object fields.
+    are represented here as object fields.  Instructions are
+    immutable, so decode can share them among callers.
     """
+    __slots__ = ("op", "cond", "reg_target", "reg_src1", "reg_src2", "offset")
 
     def __init__(self, op: OpCode, cond: CondFlag,
                      reg_target: int, reg_src1: int,
                      reg_src2: int,
                      offset: int):
         """Assemble an instruction from its fields. """
-        self.op = op  # 26-30
-        self.cond = cond  # 22-25
-        self.reg_target = reg_target  # 18-21
-        self.reg_src1 = reg_src1  # 14-17
-        self.reg_src2 = reg_src2  # 10-13
-        self.offset = offset  # 0-9
-        return
+        init = object.__setattr__
+        init(self, "op", op)  # 26-30
+        init(self, "cond", cond)  # 22-25
+        init(self, "reg_target", reg_target)  # 18-21
+        init(self, "reg_src1", reg_src1)  # 14-17
+        init(self, "reg_src2", reg_src2)  # 10-13
+        init(self, "offset", offset)  # 0-9
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Instruction is immutable; cannot set {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"Instruction is immutable; cannot delete {name}")
+
+    def _fields(self) -> tuple:
+        return (self.op, self.cond, self.reg_target,
+                self.reg_src1, self.reg_src2, self.offset)
+
+    def replace(self, **changes) -> "Instruction":
+        """A copy with some fields changed, e.g., replace(offset=0)"""
+        fields = dict(zip(Instruction.__slots__, self._fields()))
+        fields.update(changes)
+        return Instruction(**fields)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Instruction):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __hash__(self) -> int:
+        return hash(self._fields())
 
     def encode(self) -> int:
         """Encode instruction as 32-bit integer"""
@@ -121,9 +162,48 @@ class Instruction(object):
 
 #  Interpret an integer (memory word) as an instruction.
 #  This is the decode part of the fetch/decode/execute cycle of the CPU.
+#  The same few words are decoded over and over (by the CPU, the view,
+#  and disassemblers), so we remember recent decodings.  Instructions
+#  are immutable, so sharing them among callers is safe.
 #
+DECODE_CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize=DECODE_CACHE_SIZE)
 def decode(word: int) -> Instruction:
-        """Decode a memory word (32 bit int) into a new Instruction"""
-        # you must implement this function
-        return Instruction(OpCode(op_field.extract(word)), CondFlag(cond_field.extract(word)), reg_target_field.extract(word),
+        """Decode a memory word (32 bit int) into an Instruction"""
+        op = _OPCODES[op_field.extract(word)]
+        if op is None:
+            raise ValueError(f"{op_field.extract(word)} is not a valid OpCode")
+        return Instruction(op, _CONDS[cond_field.extract(word)], reg_target_field.extract(word),
                            reg_src1_field.extract(word), reg_src2_field.extract(word), offset_field.extract_signed(word))
+
+def decode_many(words: Iterable[int]) -> List[Instruction]:
+        """Decode a sequence of words, e.g., to disassemble an image"""
+        return [decode(word) for word in words]
+
+# Whole object images at once, as NumPy arrays of fields.
+# Unlike decode, these do not check for valid operation codes.
+#
+IMAGE_FIELDS = {
+    "op": op_field, "cond": cond_field, "reg_target": reg_target_field,
+    "reg_src1": reg_src1_field, "reg_src2": reg_src2_field
+    }
+
+def decode_image(words) -> Dict[str, "numpy.ndarray"]:
+        """Fields of every word, by Instruction attribute name"""
+        fields = { name: field.extract_array(words)
+                   for name, field in IMAGE_FIELDS.items() }
+        fields["offset"] = offset_field.extract_signed_array(words)
+        return fields
+
+def encode_image(op, cond, reg_target, reg_src1, reg_src2, offset) -> "numpy.ndarray":
+        """Words for arrays of fields, like Instruction.encode"""
+        import numpy as np
+        offset = np.asarray(offset)
+        words = reserved.insert_array(offset < 0, np.zeros(offset.shape, dtype=np.uint32))
+        words = op_field.insert_array(op, words)
+        words = cond_field.insert_array(cond, words)
+        words = reg_target_field.insert_array(reg_target, words)
+        words = reg_src1_field.insert_array(reg_src1, words)
+        words = reg_src2_field.insert_array(reg_src2, words)
+        return offset_field.insert_array(offset, words)
@@ -0,0 +1,180 @@
+"""
+Lockstep evaluation of many Duck Machines with NumPy.
+
+LockstepMachines runs N copies of one program, each with its own
+memory, registers, and input tape.  Registers are held as an
+(N, 16) array, and each instruction is evaluated for all machines
+at its address at once:  predication, the ALU operation, and the
+condition code are all vector operations.  Machines whose control
+flow diverges are grouped by program counter, so programs that
+branch on their input still work, in smaller groups.
+
+Console input and output use addresses 510 and 511, as in
+duck_machine.py, reading from each machine's input tape and
+appending to its output list.  Instead of raising an exception,
+a machine that faults just stops, with its status recording why.
+
+Values are 64-bit integers.  This is wide enough to agree with
+the reference CPU (which uses Python ints) for any program that
+does not overflow 64 bits, which a 32-bit array would not be.
+
+Requires NumPy.
+"""
+
+from instr_format import Instruction, OpCode, CondFlag, decode
+
+import numpy as np
+
+from typing import List, Sequence
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+CONSOLE_IN = 510
+CONSOLE_OUT = 511
+
+# Machine status
+RUNNING = 0
+HALTED = 1        # Executed HALT
+OVERFLOW = 2      # Arithmetic error, e.g., division by zero
+SEGFAULT = 3      # Bad memory or instruction address
+END_OF_INPUT = 4  # Read past the end of its input tape
+BAD_INSTR = 5     # Word at pc is not an instruction
+
+M = CondFlag.M.value
+Z = CondFlag.Z.value
+P = CondFlag.P.value
+V = CondFlag.V.value
+
+
+class LockstepMachines(object):
+    """N Duck Machines running the same program in lockstep"""
+
+    def __init__(self, program: Sequence[int], inputs: List[Sequence[int]],
+                 capacity: int=512) -> None:
+        """One machine for each input tape, all with program
+        loaded at address 0 of a memory of capacity words.
+        """
+        n = len(inputs)
+        self.capacity = capacity
+        self.regs = np.zeros((n, 16), dtype=np.int64)
+        self.cond = np.full(n, CondFlag.ALWAYS.value, dtype=np.int64)
+        self.status = np.full(n, RUNNING, dtype=np.int8)
+        self.steps = np.zeros(n, dtype=np.int64)
+        self.mem = np.zeros((n, capacity), dtype=np.int64)
+        self.mem[:, :len(program)] = np.array(program, dtype=np.int64)
+        tape_len = max([len(tape) for tape in inputs], default=0)
+        self.tapes = np.zeros((n, tape_len), dtype=np.int64)
+        for index, tape in enumerate(inputs):
+            self.tapes[index, :len(tape)] = tape
+        self.tape_len = np.array([len(tape) for tape in inputs], dtype=np.int64)
+        self.tape_pos = np.zeros(n, dtype=np.int64)
+        self.outputs: List[List[int]] = [[ ] for _ in range(n)]
+
+    def condition(self, machine: int) -> CondFlag:
+        return CondFlag(int(self.cond[machine]))
+
+    def run(self, max_steps: int=None) -> None:
+        """Step all running machines together until every machine
+        has stopped, or for at most max_steps steps.
+        """
+        taken = 0
+        while max_steps is None or taken < max_steps:
+            running = np.flatnonzero(self.status == RUNNING)
+            if running.size == 0:
+                break
+            pcs = self.regs[running, 15]
+            for pc in np.unique(pcs):
+                self._step_at(int(pc), running[pcs == pc])
+            taken += 1
+
+    def _step_at(self, pc: int, group: np.ndarray) -> None:
+        """One step of the machines in group, all with the same pc"""
+        if pc < 0 or pc >= self.capacity:
+            self.status[group] = SEGFAULT
+            return
+        words = self.mem[group, pc]
+        # Normally all machines hold the same code, but a program
+        # that stores over its instructions may differ
+        for word in np.unique(words):
+            same = group[words == word]
+            try:
+                instr = decode(int(word))
+            except ValueError:
+                self.status[same] = BAD_INSTR
+                continue
+            self._execute(pc, instr, same)
+
+    def _execute(self, pc: int, instr: Instruction, group: np.ndarray) -> None:
+        """Execute instr at pc in each machine of group"""
+        regs = self.regs
+        enabled = group[(self.cond[group] & instr.cond.value) != 0]
+        # Operands are read while r15 still holds pc
+        left = regs[enabled, instr.reg_src1]
+        right = regs[enabled, instr.reg_src2] + instr.offset
+        op = instr.op
+        overflow = None
+        if op is OpCode.ADD or op is OpCode.LOAD or op is OpCode.STORE:
+            result = left + right
+        elif op is OpCode.SUB:
+            result = left - right
+        elif op is OpCode.MUL:
+            result = left * right
+        elif op is OpCode.DIV:
+            overflow = right == 0
+            result = np.where(overflow, 0, left // np.where(overflow, 1, right))
+        else:  # HALT
+            result = np.zeros(len(enabled), dtype=np.int64)
+        flag = np.where(result == 0, Z, np.where(result > 0, P, M))
+        if overflow is not None:
+            flag[overflow] = V
+            self.status[enabled[overflow]] = OVERFLOW
+        self.cond[enabled] = flag
+        regs[group, 15] = pc + 1
+        self.steps[group] += 1
+
+        target = instr.reg_target
+        if op is OpCode.HALT:
+            self.status[enabled] = HALTED
+        elif op is OpCode.STORE:
+            self._store(enabled, result, regs[enabled, target])
+        elif op is OpCode.LOAD:
+            loaded, values = self._load(enabled, result)
+            if target != 0:
+                regs[loaded, target] = values
+        elif target != 0:
+            regs[enabled, target] = result
+
+    def _bad_addresses(self, machines: np.ndarray, addrs: np.ndarray) -> np.ndarray:
+        """Mark out-of-bounds accesses as segmentation faults"""
+        bad = (addrs < 0) | (addrs >= self.capacity)
+        self.status[machines[bad]] = SEGFAULT
+        self.steps[machines[bad]] -= 1
+        return bad
+
+    def _store(self, machines: np.ndarray, addrs: np.ndarray,
+               values: np.ndarray) -> None:
+        out = addrs == CONSOLE_OUT
+        for machine, value in zip(machines[out], values[out]):
+            self.outputs[machine].append(int(value))
+        ok = ~out & ~self._bad_addresses(machines, addrs)
+        self.mem[machines[ok], addrs[ok]] = values[ok]
+
+    def _load(self, machines: np.ndarray, addrs: np.ndarray):
+        """Returns the machines that loaded a value and the values"""
+        values = np.zeros(len(machines), dtype=np.int64)
+        ok = ~self._bad_addresses(machines, addrs)
+        reading = np.flatnonzero(ok & (addrs == CONSOLE_IN))
+        readers = machines[reading]
+        empty = self.tape_pos[readers] >= self.tape_len[readers]
+        self.status[readers[empty]] = END_OF_INPUT
+        self.steps[readers[empty]] -= 1
+        ok[reading[empty]] = False
+        readers = readers[~empty]
+        values[reading[~empty]] = self.tapes[readers, self.tape_pos[readers]]
+        self.tape_pos[readers] += 1
+        plain = ok & (addrs != CONSOLE_IN)
+        values[plain] = self.mem[machines[plain], addrs[plain]]
+        return machines[ok], values[ok]
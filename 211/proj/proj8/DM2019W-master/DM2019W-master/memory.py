@@ -6,13 +6,21 @@ is an array of 32-bit integers.
 
 from mvc import MVCEvent, MVCListenable
 
-from typing import Callable
+from array import array
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
 
 import logging
 logging.basicConfig()
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+def to_word(value: int) -> int:
+    """Wrap value around to a signed 32-bit word, as the
+    hardware would when storing it.
+    """
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
 class SegFault(Exception):
     """Segmentation fault is actually an operating-system 
     level fault, not a hardware fault, but it's what you 
@@ -47,7 +55,11 @@ class Memory(MVCListenable):
     def __init__(self, capacity: int=1024) -> None:
         super().__init__()  # Make it listenable
         self.capacity = capacity
-        self._mem = capacity * [ 0 ]
+        self._mem = self._allocate(capacity)
+
+    def _allocate(self, capacity: int) -> Sequence[int]:
+        """The storage for capacity words, all zero"""
+        return capacity * [ 0 ]
 
     def _check_bounds(self, index):
         if index < 0 or index >= self.capacity:
@@ -55,17 +67,184 @@ class Memory(MVCListenable):
 
     def get(self, index: int) -> int:
         """Fetch a word from memory"""
-        log.debug("Fetching word at memory address {}".format(index))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Fetching word at memory address {}".format(index))
+        self._check_bounds(index)
+        value = self._mem[index]
+        # Events are only built when someone (e.g., a view) is listening
+        if self.listeners:
+            self.notify_all(MemoryRead(self,index,value))
+        return value
+
+    def peek(self, index: int) -> int:
+        """The word stored at index, for tools such as a debugger:
+        no events, and no memory-mapped I/O hooks
+        """
         self._check_bounds(index)
-        self.notify_all(MemoryRead(self,index,self._mem[index]))
         return self._mem[index]
 
     def put(self, index: int, value: int) -> None:
         """Store a word into memory"""
         self._check_bounds(index)
-        log.debug("Storing value {} at memory address {}".format(value, index))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Storing value {} at memory address {}".format(value, index))
         self._mem[index] = value
-        self.notify_all(MemoryWrite(self,index,value))
+        if self.listeners:
+            self.notify_all(MemoryWrite(self,index,value))
+
+    def load_words(self, words: Iterable[int], start: int=0) -> None:
+        """Store words at consecutive addresses beginning at start,
+        in one bulk copy.  Like loading a program from disk, this
+        bypasses memory-mapped I/O hooks.
+        """
+        words = self._pack(words)
+        if len(words) == 0:
+            return
+        self._check_bounds(start)
+        self._check_bounds(start + len(words) - 1)
+        self._mem[start:start + len(words)] = words
+        if self.listeners:
+            for addr, value in enumerate(words, start):
+                self.notify_all(MemoryWrite(self, addr, value))
+
+    def _pack(self, words: Iterable[int]) -> Sequence[int]:
+        """Convert words to the form held in storage"""
+        return list(words)
+
+    def dump(self) -> Sequence[int]:
+        """A copy of the whole memory contents"""
+        return self._mem[:]
+
+    def segments(self) -> Iterable[Tuple[int, Sequence[int]]]:
+        """The stored contents as (start address, words) runs.
+        Addresses in no run hold 0.
+        """
+        yield 0, self._mem
+
+    def clear(self) -> None:
+        """Set every word to 0, without notifying listeners"""
+        self._mem = self._allocate(self.capacity)
+
+
+class CompactMemory(Memory):
+    """Memory held in a packed array of signed 32-bit words,
+    rather than a list of Python ints.  Stores wrap around
+    to 32 bits.  Bulk loads accept either ints or a buffer
+    of native byte order 32-bit words.
+    """
+
+    def _allocate(self, capacity: int) -> array:
+        return array('i', bytes(4 * capacity))
+
+    def put(self, index: int, value: int) -> None:
+        """Store a word into memory, wrapping to 32 bits"""
+        super().put(index, to_word(value))
+
+    def _pack(self, words) -> array:
+        if isinstance(words, array) and words.typecode == 'i':
+            return words
+        if isinstance(words, (bytes, bytearray, memoryview)):
+            packed = array('i')
+            packed.frombytes(words)
+            return packed
+        return array('i', [to_word(word) for word in words])
+
+    def snapshot(self) -> memoryview:
+        """A read-only view of memory, without copying it.  The
+        view follows later stores; copy it (e.g., with bytes())
+        to keep the contents at a particular moment.
+        """
+        return memoryview(self._mem).toreadonly()
+
+class PagedMemory(Memory):
+    """Memory allocated one page at a time, on the first write
+    to each page.  Reads from a page never written see a shared
+    page of zeros, so a large address space costs only as much
+    as the pages a program actually stores into.
+    """
+
+    def __init__(self, capacity: int=1024, page_size: int=256) -> None:
+        assert page_size > 0 and page_size & (page_size - 1) == 0, \
+            "Page size must be a power of 2"
+        self.page_size = page_size
+        self._page_shift = page_size.bit_length() - 1
+        self._page_mask = page_size - 1
+        self._zero_page = page_size * [ 0 ]
+        super().__init__(capacity)
+
+    def _allocate(self, capacity: int) -> Dict[int, List[int]]:
+        return { }
+
+    def _page(self, page_num: int) -> List[int]:
+        """The page to write, allocating it if needed"""
+        page = self._mem.get(page_num)
+        if page is None:
+            page = self.page_size * [ 0 ]
+            self._mem[page_num] = page
+        return page
+
+    @property
+    def pages_allocated(self) -> int:
+        return len(self._mem)
+
+    def get(self, index: int) -> int:
+        """Fetch a word from memory"""
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Fetching word at memory address {}".format(index))
+        self._check_bounds(index)
+        page = self._mem.get(index >> self._page_shift, self._zero_page)
+        value = page[index & self._page_mask]
+        if self.listeners:
+            self.notify_all(MemoryRead(self,index,value))
+        return value
+
+    def peek(self, index: int) -> int:
+        self._check_bounds(index)
+        page = self._mem.get(index >> self._page_shift, self._zero_page)
+        return page[index & self._page_mask]
+
+    def put(self, index: int, value: int) -> None:
+        """Store a word into memory"""
+        self._check_bounds(index)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Storing value {} at memory address {}".format(value, index))
+        self._page(index >> self._page_shift)[index & self._page_mask] = value
+        if self.listeners:
+            self.notify_all(MemoryWrite(self,index,value))
+
+    def load_words(self, words: Iterable[int], start: int=0) -> None:
+        """Store words at consecutive addresses, a page at a time"""
+        words = self._pack(words)
+        if len(words) == 0:
+            return
+        self._check_bounds(start)
+        self._check_bounds(start + len(words) - 1)
+        done = 0
+        while done < len(words):
+            addr = start + done
+            offset = addr & self._page_mask
+            count = min(self.page_size - offset, len(words) - done)
+            page = self._page(addr >> self._page_shift)
+            page[offset:offset + count] = words[done:done + count]
+            done += count
+        if self.listeners:
+            for addr, value in enumerate(words, start):
+                self.notify_all(MemoryWrite(self, addr, value))
+
+    def segments(self) -> Iterable[Tuple[int, Sequence[int]]]:
+        """The allocated pages only"""
+        for page_num in sorted(self._mem):
+            start = page_num << self._page_shift
+            yield start, self._mem[page_num][:self.capacity - start]
+
+    def dump(self) -> List[int]:
+        """A copy of the whole memory contents, allocated or not"""
+        words = self.capacity * [ 0 ]
+        for page_num, page in self._mem.items():
+            start = page_num << self._page_shift
+            count = min(self.page_size, self.capacity - start)
+            words[start:start + count] = page[:count]
+        return words
 
 
 class MemoryMappedIO(Memory):
@@ -104,3 +283,13 @@ class MemoryMappedIO(Memory):
             hook(index, value)
             return
         super().put(index, value)
+
+
+class CompactMemoryMappedIO(MemoryMappedIO, CompactMemory):
+    """Memory-mapped I/O over packed 32-bit storage"""
+    pass
+
+
+class PagedMemoryMappedIO(MemoryMappedIO, PagedMemory):
+    """Memory-mapped I/O over paged storage"""
+    pass
@@ -0,0 +1,164 @@
+"""
+Multi-core Duck Machine.
+
+Several CPU cores share one memory through a Bus.  Each core has
+its own Port on the bus, which counts the core's memory accesses
+and answers reads of address CORE_ID (509) with the core's number,
+so that every core can run the same program and divide up the work.
+Cores synchronize by spinning on flags in shared memory.
+
+A MultiCore machine interleaves its cores with a deterministic
+round-robin scheduler:  each core in turn runs for a quantum of
+steps.  A run of the same program on the same memory always
+interleaves the same way.
+
+A ThreadedCPU or BlockCPU core keeps its compiled code from one
+quantum to the next.  Each Port reports the words it writes to the
+other cores, which drop any code compiled from them.
+
+The simulator itself runs on one Python thread, so speedup is
+measured in steps, as a multi-core processor running one step per
+core per cycle would see it:  the time of a parallel run is the
+step count of its busiest core.
+"""
+
+from cpu import CPU
+from memory import Memory
+from threaded import ThreadedCPU
+
+from typing import Callable, Dict, List, Optional
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+CORE_ID = 509
+
+
+class Port(object):
+    """One core's connection to the shared memory.  Anything
+    other than get and put is passed through to the memory.
+    """
+
+    def __init__(self, memory: Memory, core: int) -> None:
+        self.memory = memory
+        self.core = core
+        self.reads = 0    # Including instruction fetches
+        self.writes = 0
+        # Called with the address of each word written
+        self.on_write: List[Callable[[int], None]] = [ ]
+
+    def get(self, addr: int) -> int:
+        self.reads += 1
+        if addr == CORE_ID:
+            return self.core
+        return self.memory.get(addr)
+
+    def put(self, addr: int, value: int) -> None:
+        self.writes += 1
+        self.memory.put(addr, value)
+        for notify in self.on_write:
+            notify(addr)
+
+    def peek(self, addr: int) -> int:
+        """Like get, but not counted as an access"""
+        if addr == CORE_ID:
+            return self.core
+        return self.memory.peek(addr)
+
+    def __getattr__(self, name: str):
+        return getattr(self.memory, name)
+
+
+class Bus(object):
+    """Connects cores to one memory"""
+
+    def __init__(self, memory: Memory, cores: int) -> None:
+        self.memory = memory
+        self.ports = [Port(memory, core) for core in range(cores)]
+
+    def port(self, core: int) -> Port:
+        return self.ports[core]
+
+
+class MultiCore(object):
+    """N cores of the given CPU class sharing memory"""
+
+    def __init__(self, memory: Memory, cores: int=2, engine: type=CPU,
+                 quantum: int=1) -> None:
+        self.bus = Bus(memory, cores)
+        self.cores: List[CPU] = [engine(port) for port in self.bus.ports]
+        compiled = [core for core in self.cores if isinstance(core, ThreadedCPU)]
+        for core in compiled:
+            core.keep_code = True
+        for port, core in zip(self.bus.ports, self.cores):
+            port.on_write = [other.forget_code for other in compiled if other is not core]
+        self.quantum = quantum
+        self.steps = [0] * cores    # Steps taken by each core
+        self.faults: Dict[int, Exception] = { }
+        self.rounds = 0
+
+    def running(self) -> List[int]:
+        return [index for index, core in enumerate(self.cores)
+                if not core.halted and index not in self.faults]
+
+    def run(self, entry: int=0, max_rounds: Optional[int]=None) -> None:
+        """Start every core at entry and run until all halt (or
+        fault), or for at most max_rounds rounds of the scheduler
+        """
+        for core in self.cores:
+            core.registers[15].put(entry)
+            core.halted = False
+            if isinstance(core, ThreadedCPU):
+                # Memory may have been loaded since the last run
+                core.forget_code()
+        self.resume(max_rounds)
+
+    def resume(self, max_rounds: Optional[int]=None) -> None:
+        """Continue running the cores that have not halted"""
+        rounds = 0
+        while max_rounds is None or rounds < max_rounds:
+            running = self.running()
+            if not running:
+                break
+            for index in running:
+                self._slice(index)
+            rounds += 1
+        self.rounds += rounds
+
+    def _slice(self, index: int) -> None:
+        """One quantum of one core.  An error in the core (but
+        not, e.g., a KeyboardInterrupt) stops only that core.
+        """
+        core = self.cores[index]
+        try:
+            core.run(from_addr=None, max_steps=self.quantum)
+        except Exception as e:
+            log.info(f"Core {index} faulted: {e}")
+            self.faults[index] = e
+        finally:
+            self.steps[index] += core.step_count
+
+    def makespan(self) -> int:
+        """Steps of the busiest core, i.e., the time of the run"""
+        return max(self.steps)
+
+    def speedup(self, single_core_steps: int) -> float:
+        """Speedup over a single core that took single_core_steps"""
+        return single_core_steps / max(self.makespan(), 1)
+
+    def report(self, single_core_steps: int=None) -> str:
+        """Per-core steps, memory traffic, and utilization"""
+        span = max(self.makespan(), 1)
+        lines = [f"{len(self.cores)} cores, quantum {self.quantum},"
+                 + f" {self.rounds} rounds, {self.makespan()} steps"]
+        lines.append(f"{'core':>4} {'steps':>10} {'busy':>6} {'reads':>10} {'writes':>10}")
+        for index, (core, port) in enumerate(zip(self.cores, self.bus.ports)):
+            status = "fault" if index in self.faults else ("halted" if core.halted else "")
+            lines.append(f"{index:>4} {self.steps[index]:>10} {100 * self.steps[index] / span:>5.1f}%"
+                         + f" {port.reads:>10} {port.writes:>10}  {status}")
+        if single_core_steps is not None:
+            lines.append(f"Speedup over one core ({single_core_steps} steps):"
+                         + f" {self.speedup(single_core_steps):.2f}")
+        return "\n".join(lines)
@@ -28,6 +28,9 @@ class MVCListenable(object):
     def register_listener(self, listener: MVCListener) -> None:
         self.listeners.append(listener)
 
+    def unregister_listener(self, listener: MVCListener) -> None:
+        self.listeners.remove(listener)
+
     def notify_all(self, event: MVCEvent) -> None:
         for listener in self.listeners:
             listener.notify(event)
@@ -0,0 +1,131 @@
+"""
+Duck Machine object files.
+
+The standard object code format (.obj) is text, one decimal
+integer per line, loaded at address 0.  The binary format (.dobj)
+is faster to load, and can place several segments anywhere in
+memory:
+
+    header     "DUCK", version (u16), flags (u16, unused),
+               entry point (i32), number of segments (u32)
+    segments   for each: load address (u32), word count (u32),
+               byte offset of its words in the file (u32)
+    words      signed 32-bit little-endian integers
+
+All header and table fields are little-endian too.  A binary
+file is memory-mapped and copied into memory one segment at
+a time, without parsing each word.
+"""
+
+from memory import Memory, to_word
+
+from array import array
+import io
+import mmap
+import struct
+import sys
+
+from typing import List, Sequence, Tuple
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+MAGIC = b"DUCK"
+VERSION = 1
+HEADER = struct.Struct("<4sHHiI")
+SEGMENT = struct.Struct("<III")
+
+# A segment is a load address and the words to place there
+Segment = Tuple[int, Sequence[int]]
+
+
+class ObjectFileError(Exception):
+    """The file is not a valid binary object file"""
+    pass
+
+
+def read_text(file: io.IOBase) -> List[int]:
+    """Words of a text (.obj) object file"""
+    return [int(line) for line in file if line.strip()]
+
+
+def write_binary(file: io.IOBase, segments: List[Segment],
+                 entry: int=0) -> None:
+    """Write segments to a binary file opened in 'wb' mode"""
+    offset = HEADER.size + len(segments) * SEGMENT.size
+    file.write(HEADER.pack(MAGIC, VERSION, 0, entry, len(segments)))
+    for addr, words in segments:
+        file.write(SEGMENT.pack(addr, len(words), offset))
+        offset += 4 * len(words)
+    for addr, words in segments:
+        packed = array('i', [to_word(word) for word in words])
+        if sys.byteorder == "big":
+            packed.byteswap()
+        file.write(packed.tobytes())
+
+
+def is_binary(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_binary(path: str, memory: Memory) -> int:
+    """Copy the segments of a binary object file into memory.
+    Returns the entry point.
+    """
+    with open(path, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise ObjectFileError(f"{path} is empty")
+    with mapped, memoryview(mapped) as view:
+        if len(view) < HEADER.size:
+            raise ObjectFileError(f"{path} is too short for a header")
+        magic, version, _, entry, count = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ObjectFileError(f"{path} is not a version {VERSION} binary object file")
+        if HEADER.size + count * SEGMENT.size > len(view):
+            raise ObjectFileError(f"Segment table of {path} is truncated")
+        for index in range(count):
+            addr, length, offset = SEGMENT.unpack_from(
+                view, HEADER.size + index * SEGMENT.size)
+            if offset + 4 * length > len(view):
+                raise ObjectFileError(f"Segment {index} of {path} is truncated")
+            words = array('i')
+            with view[offset:offset + 4 * length] as raw:
+                words.frombytes(raw)
+            if sys.byteorder == "big":
+                words.byteswap()
+            log.debug(f"Loading {length} words at {addr}")
+            memory.load_words(words, start=addr)
+    return entry
+
+
+def load_program(path: str, memory: Memory) -> int:
+    """Load a text or binary object file, whichever path is.
+    Returns the entry point (always 0 for text files).
+    """
+    if is_binary(path):
+        return load_binary(path, memory)
+    with open(path) as f:
+        memory.load_words(read_text(f))
+    return 0
+
+
+def convert(text_path: str, binary_path: str) -> None:
+    """Import a text object file as a single segment binary file"""
+    with open(text_path) as f:
+        words = read_text(f)
+    with open(binary_path, "wb") as f:
+        write_binary(f, [(0, words)])
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert .obj to binary .dobj")
+    parser.add_argument("objfile", help="Text object file input")
+    parser.add_argument("binfile", help="Binary object file output")
+    args = parser.parse_args()
+    convert(args.objfile, args.binfile)
@@ -0,0 +1,165 @@
+"""
+Timing model of a 5-stage pipelined Duck Machine.
+
+CPU.step executes each instruction completely before starting the
+next.  A pipelined core overlaps them in five stages, fetch (IF),
+decode and register read (ID), execute (EX), memory access (MEM),
+and register write-back (WB), ideally finishing one instruction
+per cycle.  It falls short of that when
+
+  - an instruction needs a register value that an earlier
+    instruction has not produced yet (a data hazard), and must
+    wait (stall) in ID until the value can be forwarded or read
+    from the register file.  The condition code counts as a
+    register:  every executed instruction writes it, and every
+    predicated instruction (e.g., JUMP/P) reads it, or
+  - an instruction writes r15, i.e., jumps (a control hazard).  The
+    jump is known only when it executes, so the instructions
+    fetched after it are discarded.
+
+A Pipeline listens to CPUStep events, like the Profiler, and works
+out the cycle in which each instruction could enter ID.  The CPU
+itself still executes normally, so architectural results are
+unchanged.  Predicated-off instructions flow through the pipeline
+without writing a register.
+
+With forwarding, a result is available to the next instruction
+right after EX, except that a LOAD's value is available only after
+MEM, so an instruction using it immediately stalls one cycle (a
+load-use hazard).  Without forwarding, values are read from the
+register file, written in the first half of WB, so a dependent
+instruction stalls until the writer's WB cycle.
+"""
+
+from mvc import MVCEvent, MVCListener
+from cpu import CPU, CPUStep
+from instr_format import OpCode, CondFlag
+
+from collections import Counter
+from typing import Dict, Tuple
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+STAGES = 5
+
+# Key of the condition code among the registers in Pipeline.ready
+FLAGS = 16
+
+
+class Pipeline(MVCListener):
+    """Cycle counts for the instructions executed by one CPU"""
+
+    def __init__(self, cpu: CPU, forwarding: bool=True,
+                 branch_penalty: int=2) -> None:
+        """branch_penalty is the number of cycles lost when an
+        ALU instruction writes r15.  A LOAD into r15 is known one
+        stage later, so loses one more.
+        """
+        self.cpu = cpu
+        self.forwarding = forwarding
+        self.branch_penalty = branch_penalty
+        self.reset()
+        cpu.register_listener(self)
+
+    def reset(self) -> None:
+        self.instructions = 0
+        self.last_issue = 0        # ID cycle of the latest instruction
+        self.fetch_ready = 0       # Earliest ID cycle after a jump
+        # Register (or FLAGS) -> (earliest ID cycle of a reader,
+        # written by LOAD, WB cycle of the writer)
+        self.ready: Dict[int, Tuple[int, bool, int]] = { }
+        self.data_hazards = 0      # Reads of a value still in the pipeline
+        self.load_use = 0          # ... that stalled because it was loaded
+        self.data_stalls = 0       # Cycles lost to data hazards
+        self.control_hazards = 0   # Taken jumps
+        self.control_stalls = 0    # Cycles lost to jumps
+        self.stalls_at = Counter() # Address -> cycles lost there
+
+    def detach(self) -> None:
+        self.cpu.unregister_listener(self)
+
+    def notify(self, event: MVCEvent) -> None:
+        if isinstance(event, CPUStep):
+            self._issue(event)
+
+    def _issue(self, event: CPUStep) -> None:
+        instr = event.instr
+        op = instr.op
+        self.instructions += 1
+        earliest = self.last_issue + 1
+        control = max(self.fetch_ready - earliest, 0)
+        earliest += control
+        # Operands, including the register a STORE stores
+        sources = {instr.reg_src1, instr.reg_src2}
+        if op is OpCode.STORE:
+            sources.add(instr.reg_target)
+        # and the condition code, unless the predicate is ALWAYS or NEVER
+        if instr.cond not in (CondFlag.ALWAYS, CondFlag.NEVER):
+            sources.add(FLAGS)
+        issue = earliest
+        from_load = False
+        for reg in sources:
+            if reg in self.ready:
+                ready, loaded, written = self.ready[reg]
+                # Not yet in the register file when we would read it
+                if written > earliest:
+                    self.data_hazards += 1
+                if ready > issue:
+                    issue = ready
+                    from_load = loaded
+        data = issue - earliest
+        if data:
+            if from_load and self.forwarding:
+                self.load_use += 1
+            self.data_stalls += data
+        self.control_stalls += control
+        if data or control:
+            self.stalls_at[event.pc_addr] += data + control
+        self.last_issue = issue
+        # The event comes before the instruction executes
+        if not self.cpu.condition & instr.cond:
+            return
+        written = issue + 3
+        # Flags come from EX, even for a LOAD (from its address)
+        self.ready[FLAGS] = (issue + 1 if self.forwarding else written, False, written)
+        target = instr.reg_target
+        if op in (OpCode.STORE, OpCode.HALT) or target == 0:
+            return
+        is_load = op is OpCode.LOAD
+        if target == 15:
+            self.control_hazards += 1
+            self.fetch_ready = issue + 1 + self.branch_penalty + is_load
+            return
+        if self.forwarding:
+            self.ready[target] = (issue + 1 + is_load, is_load, written)
+        else:
+            self.ready[target] = (written, is_load, written)
+
+    def cycles(self) -> int:
+        """Cycles from the first fetch to the last write-back"""
+        if not self.instructions:
+            return 0
+        return self.last_issue + STAGES - 1
+
+    def cpi(self) -> float:
+        return self.cycles() / max(self.instructions, 1)
+
+    def report(self, limit: int=10) -> str:
+        """Cycles per instruction and where the stalls were"""
+        forwarding = "with" if self.forwarding else "without"
+        lines = [f"{STAGES}-stage pipeline {forwarding} forwarding:",
+                 f"{self.instructions} instructions, {self.cycles()} cycles,"
+                 + f" CPI {self.cpi():.2f}",
+                 f"Data hazards: {self.data_hazards}"
+                 + (f" ({self.load_use} load-use)" if self.forwarding else "")
+                 + f", {self.data_stalls} stall cycles",
+                 f"Control hazards: {self.control_hazards},"
+                 + f" {self.control_stalls} stall cycles"]
+        if self.stalls_at:
+            lines.append("Stalls by address:")
+            for addr, count in self.stalls_at.most_common(limit):
+                lines.append(f"{addr:>6} {count:>10}")
+        return "\n".join(lines)
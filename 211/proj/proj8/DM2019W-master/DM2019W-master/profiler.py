@@ -0,0 +1,95 @@
+"""
+Instruction-level profiler for the Duck Machine.
+
+A Profiler listens to the CPU and its memory, like the graphical
+view does, and counts executions per address, per operation code,
+and data reads and writes per address.  Accesses through a Cache
+are counted too.  Since it is an ordinary
+listener, an unprofiled run pays nothing for it.
+"""
+
+from mvc import MVCEvent, MVCListener
+from cpu import CPU, CPUStep
+from memory import MemoryRead, MemoryWrite
+from cache import CacheAccess
+from instr_format import Instruction
+
+from collections import Counter
+from typing import Dict
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+class Profiler(MVCListener):
+    """Execution counts for one CPU.  Each step is one cycle
+    of the Duck Machine.
+    """
+
+    def __init__(self, cpu: CPU) -> None:
+        self.cpu = cpu
+        self.steps = 0
+        self.executed = Counter()   # address -> steps with pc there
+        self.skipped = Counter()    # address -> steps predicated off
+        self.op_counts = Counter()  # OpCode -> steps executing it
+        self.reads = Counter()      # address -> reads, including fetches
+        self.writes = Counter()     # address -> writes
+        self.instrs: Dict[int, Instruction] = { }
+        cpu.register_listener(self)
+        cpu.memory.register_listener(self)
+
+    def detach(self) -> None:
+        """Stop profiling"""
+        self.cpu.unregister_listener(self)
+        self.cpu.memory.unregister_listener(self)
+
+    def notify(self, event: MVCEvent) -> None:
+        if isinstance(event, CPUStep):
+            self.steps += 1
+            self.executed[event.pc_addr] += 1
+            self.op_counts[event.instr.op] += 1
+            self.instrs[event.pc_addr] = event.instr
+            # The event comes before the instruction executes
+            if not self.cpu.condition & event.instr.cond:
+                self.skipped[event.pc_addr] += 1
+        elif isinstance(event, CacheAccess):
+            if event.write:
+                self.writes[event.addr] += 1
+            else:
+                self.reads[event.addr] += 1
+        elif isinstance(event, MemoryRead):
+            self.reads[event.addr] += 1
+        elif isinstance(event, MemoryWrite):
+            self.writes[event.addr] += 1
+
+    def data_reads(self, addr: int) -> int:
+        """Reads of addr other than instruction fetches"""
+        return self.reads[addr] - self.executed[addr]
+
+    def report(self, limit: int=20) -> str:
+        """Hot spots, operation mix, and busiest data addresses"""
+        total = max(self.steps, 1)
+        lines = [f"{self.steps} steps"]
+        lines.append("")
+        lines.append("Hot spots:")
+        lines.append(f"{'addr':>6} {'count':>10} {'%':>6} {'skipped':>8}  instruction")
+        for addr, count in self.executed.most_common(limit):
+            lines.append(f"{addr:>6} {count:>10} {100 * count / total:>5.1f}%"
+                         + f" {self.skipped[addr]:>8}  {self.instrs[addr]}")
+        lines.append("")
+        lines.append("Operations:")
+        for op, count in self.op_counts.most_common():
+            lines.append(f"{op.name:>6} {count:>10} {100 * count / total:>5.1f}%")
+        lines.append("")
+        lines.append("Data accesses:")
+        lines.append(f"{'addr':>6} {'reads':>10} {'writes':>10}")
+        data = Counter()
+        for addr in set(self.reads) | set(self.writes):
+            data[addr] = self.data_reads(addr) + self.writes[addr]
+        for addr, count in data.most_common(limit):
+            if count == 0:
+                break
+            lines.append(f"{addr:>6} {self.data_reads(addr):>10} {self.writes[addr]:>10}")
+        return "\n".join(lines)
@@ -6,6 +6,7 @@ The Zero register is special: It always holds 0.
 
 class Register(object):
     """Holds a 32-bit integer"""
+    __slots__ = ("value",)
 
     def __init__(self):
         self.value = 0
@@ -18,8 +19,62 @@ class Register(object):
 
 class ZeroRegister(Register):
     """A register whose value can never change"""
-    
+    __slots__ = ()
+
     def put(self, value) -> None:
         pass
 
     
+
+class RegisterView(Register):
+    """One register of a RegisterFile, with the Register
+    interface.  Holds no value of its own.
+    """
+    __slots__ = ("values", "index")
+
+    def __init__(self, values: list, index: int) -> None:
+        self.values = values
+        self.index = index
+
+    @property
+    def value(self) -> int:
+        return self.values[self.index]
+
+    def get(self) -> int:
+        return self.values[self.index]
+
+    def put(self, value) -> None:
+        if self.index:
+            self.values[self.index] = value
+
+
+class RegisterFile(object):
+    """All the registers of the CPU in one list of ints, so that
+    the CPU can read and write them without method calls.
+    Register 0 always holds zero:  code that writes values
+    directly must reset values[0] to 0 after writing it.
+    Register 15 is the program counter.  Indexing a RegisterFile
+    gives a Register-compatible view of one register.
+    """
+    __slots__ = ("values", "views")
+
+    def __init__(self, count: int=16) -> None:
+        self.values = [0] * count
+        self.views = [RegisterView(self.values, index) for index in range(count)]
+
+    def __getitem__(self, index):
+        return self.views[index]
+
+    def __len__(self) -> int:
+        return len(self.views)
+
+    def __iter__(self):
+        return iter(self.views)
+
+    @property
+    def pc(self) -> int:
+        return self.values[15]
+
+    @pc.setter
+    def pc(self, value: int) -> None:
+        self.values[15] = value
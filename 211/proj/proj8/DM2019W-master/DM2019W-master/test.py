@@ -1,6 +1,38 @@
 import unittest
+import unittest.mock
 from instr_format import *
 from cpu import *
+from memory import Memory, MemoryMappedIO, MemoryRead, MemoryWrite
+from memory import CompactMemory, CompactMemoryMappedIO, SegFault
+from memory import PagedMemory, PagedMemoryMappedIO
+from mvc import MVCListener
+from register import Register, RegisterFile, ZeroRegister
+from threaded import ThreadedCPU
+from blocks import BlockCPU
+import assembler
+import batch
+import bench
+from cache import Cache, CacheHit, CacheMiss, CacheEvict
+import devices
+import difftest
+from debugger import Debugger, Stop
+import multicore
+from profiler import Profiler
+from pipeline import Pipeline
+import io
+import json
+import objfile
+import os
+import tempfile
+import tracing
+
+try:
+    import numpy
+    import lockstep
+except ImportError:
+    numpy = None
+
+PROGRAMS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "programs")
 
 class TestDecode(unittest.TestCase):
     """Encoding and decoding should be inverses"""
@@ -10,6 +42,29 @@ class TestDecode(unittest.TestCase):
         text = str(decode(word))
         self.assertEqual(text, str(instr))
 
+    def test_decode_many(self):
+        with open(os.path.join(PROGRAMS, "max.obj")) as f:
+            words = objfile.read_text(f)
+        decoded = decode_many(words)
+        self.assertEqual([str(instr) for instr in decoded],
+                         [str(decode(word)) for word in words])
+        self.assertEqual(str(decoded[3]), "ADD/P   r15,r0,r15[3]")
+
+    def test_shared_decodings_are_immutable(self):
+        word = Instruction(OpCode.ADD, CondFlag.P, 1, 2, 3, -4).encode()
+        instr = decode(word)
+        with self.assertRaises(AttributeError):
+            instr.offset = 5
+        changed = instr.replace(offset=5)
+        self.assertEqual(changed.offset, 5)
+        self.assertIs(decode(word), instr)
+        self.assertEqual(decode(word).offset, -4)
+        self.assertEqual(decode(word), Instruction(OpCode.ADD, CondFlag.P, 1, 2, 3, -4))
+
+    def test_bad_opcode(self):
+        with self.assertRaises(ValueError):
+            decode(4 << 26)
+
 class TestALU(unittest.TestCase):
     """Simple smoke test of each ALU op"""
 
@@ -40,5 +95,1026 @@ class TestALU(unittest.TestCase):
         self.assertEqual(alu.exec(OpCode.STORE, 27, 13), (40, CondFlag.P))
         self.assertEqual(alu.exec(OpCode.HALT, 99, 98), (0, CondFlag.Z))
 
+def assemble(*instrs) -> list:
+    """Encode a short program given as Instruction objects or data ints"""
+    return [i if isinstance(i, int) else i.encode() for i in instrs]
+
+def io_memory(inputs: list, outputs: list) -> MemoryMappedIO:
+    """Memory with console addresses 510, 511 mapped to lists"""
+    mem = MemoryMappedIO(512)
+    tape = iter(inputs)
+    mem.map_address_in(510, lambda addr: next(tape))
+    mem.map_address_out(511, lambda addr, value: outputs.append(value))
+    return mem
+
+def load_obj(name: str, memory: Memory) -> None:
+    with open(os.path.join(PROGRAMS, name)) as f:
+        memory.load_words([int(line) for line in f])
+
+def machine_state(cpu: CPU) -> tuple:
+    return ([reg.get() for reg in cpu.registers], cpu.condition,
+            cpu.halted, list(cpu.memory._mem))
+
+SELF_MODIFYING = assemble(
+    Instruction(OpCode.ADD, CondFlag.ALWAYS, 1, 0, 0, 2),       # r1 = 2
+    Instruction(OpCode.LOAD, CondFlag.ALWAYS, 2, 0, 0, 8),      # r2 = mem[8]
+    Instruction(OpCode.ADD, CondFlag.ALWAYS, 3, 3, 0, 1),       # r3 += 1
+    Instruction(OpCode.STORE, CondFlag.ALWAYS, 2, 0, 0, 2),     # mem[2] = r2
+    Instruction(OpCode.SUB, CondFlag.ALWAYS, 1, 1, 0, 1),       # r1 -= 1
+    Instruction(OpCode.ADD, CondFlag.P, 15, 0, 0, 2),           # loop to 2
+    Instruction(OpCode.HALT, CondFlag.ALWAYS, 0, 0, 0, 0),
+    0,
+    Instruction(OpCode.SUB, CondFlag.ALWAYS, 3, 3, 0, 1))       # r3 -= 1
+
+class TestCPU(unittest.TestCase):
+    """Run small programs on the CPU"""
+
+    def test_decode_cache_sees_stores(self):
+        # The STORE overwrites the ADD at address 2 after it has
+        # already been executed (and decoded) once.
+        mem = Memory(64)
+        mem.load_words(SELF_MODIFYING)
+        cpu = CPU(mem)
+        cpu.run()
+        # Second pass through the loop runs the stored SUB
+        self.assertEqual(cpu.registers[3].get(), 0)
+        self.assertEqual(mem.get(2), SELF_MODIFYING[8])
+
+    def test_listeners_registered_later_see_events(self):
+        mem = Memory(64)
+        mem.load_words(SELF_MODIFYING)
+        cpu = CPU(mem)
+        cpu.run()
+        events = [ ]
+        recorder = MVCListener()
+        recorder.notify = events.append
+        cpu.register_listener(recorder)
+        mem.register_listener(recorder)
+        cpu.run()
+        steps = [e for e in events if isinstance(e, CPUStep)]
+        writes = [e for e in events if isinstance(e, MemoryWrite)]
+        self.assertEqual([e.pc_addr for e in steps[:3]], [0, 1, 2])
+        self.assertEqual([e.addr for e in writes], [2, 2])
+
+    def test_single_step_pauses_after_events(self):
+        """Each prompt comes after all events of the step before it"""
+        mem = Memory(64)
+        mem.load_words(SELF_MODIFYING)
+        cpu = CPU(mem)
+        events = [ ]
+        recorder = MVCListener()
+        recorder.notify = events.append
+        cpu.register_listener(recorder)
+        mem.register_listener(recorder)
+        prompts = [ ]
+        with unittest.mock.patch("builtins.input",
+                                 lambda prompt: prompts.append(len(events))):
+            cpu.run(single_step=True, max_steps=3)
+        pauses = [index for index, e in enumerate(events) if isinstance(e, CPUPause)]
+        self.assertEqual(prompts, [index + 1 for index in pauses])
+        self.assertEqual([events[index].step_count for index in pauses], [0, 1, 2])
+        # The LOAD's read of mem[8] is delivered before the next prompt
+        self.assertIsInstance(events[pauses[2] - 1], MemoryRead)
+        self.assertEqual(events[pauses[2] - 1].addr, 8)
+
+class TestRegisterFile(unittest.TestCase):
+    """Register views share the register file's values"""
+
+    def test_views(self):
+        regs = RegisterFile()
+        regs[3].put(7)
+        regs[0].put(9)
+        self.assertEqual(regs.values[3], 7)
+        self.assertEqual(regs[0].get(), 0)
+        regs.values[15] = 12
+        self.assertEqual(regs[15].get(), 12)
+        regs.pc = 4
+        self.assertEqual(regs[15].value, 4)
+        self.assertEqual([reg.get() for reg in regs], [0, 0, 0, 7] + 11 * [0] + [4])
+        # Views are slotted, with no per-instance dict
+        self.assertFalse(hasattr(regs[3], "__dict__"))
+        with self.assertRaises(AttributeError):
+            regs[3].extra = 1
+
+    def test_plain_registers(self):
+        reg, zero = Register(), ZeroRegister()
+        reg.put(5)
+        zero.put(5)
+        self.assertEqual((reg.get(), zero.get()), (5, 0))
+
+    def test_load_to_zero(self):
+        mem = Memory(16)
+        mem.load_words(assemble(
+            Instruction(OpCode.LOAD, CondFlag.ALWAYS, 0, 0, 0, 3),
+            Instruction(OpCode.ADD, CondFlag.ALWAYS, 1, 0, 0, 1),
+            Instruction(OpCode.HALT, CondFlag.ALWAYS, 0, 0, 0, 0),
+            42))
+        cpu = CPU(mem)
+        cpu.run()
+        self.assertEqual(cpu.registers.values[:2], [0, 1])
+
+class TestCompactMemory(unittest.TestCase):
+    """Packed 32-bit memory"""
+
+    def test_wraparound(self):
+        mem = CompactMemory(16)
+        mem.put(3, 2 ** 31)
+        self.assertEqual(mem.get(3), -2 ** 31)
+        mem.put(4, -1)
+        self.assertEqual(mem.get(4), -1)
+        with self.assertRaises(SegFault):
+            mem.put(16, 1)
+
+    def test_bulk_load_and_dump(self):
+        mem = CompactMemory(8)
+        mem.load_words([1, -2, 2 ** 32 + 3], start=2)
+        self.assertEqual(list(mem.dump()), [0, 0, 1, -2, 3, 0, 0, 0])
+        with self.assertRaises(SegFault):
+            mem.load_words([1, 2, 3], start=6)
+        view = mem.snapshot()
+        self.assertTrue(view.readonly)
+        mem.put(0, 9)
+        self.assertEqual(view[0], 9)
+
+    def test_runs_programs(self):
+        outputs = [ ]
+        mem = CompactMemoryMappedIO(512)
+        mem.map_address_in(510, lambda addr: 5)
+        mem.map_address_out(511, lambda addr, value: outputs.append(value))
+        load_obj("fact.obj", mem)
+        CPU(mem).run()
+        self.assertEqual(outputs, [120])
+
+class TestPagedMemory(unittest.TestCase):
+    """Sparse memory allocates only pages that are written"""
+
+    def test_sparse(self):
+        mem = PagedMemory(2 ** 30, page_size=64)
+        self.assertEqual(mem.get(2 ** 30 - 1), 0)
+        mem.put(1000, 7)
+        mem.load_words([1, 2, 3], start=126)
+        self.assertEqual(mem.pages_allocated, 3)
+        self.assertEqual([mem.get(addr) for addr in range(125, 130)], [0, 1, 2, 3, 0])
+        self.assertEqual(mem.get(1000), 7)
+        with self.assertRaises(SegFault):
+            mem.get(2 ** 30)
+        with self.assertRaises(SegFault):
+            mem.put(-1, 0)
+
+    def test_runs_programs(self):
+        for engine in [CPU, BlockCPU]:
+            outputs = [ ]
+            mem = PagedMemoryMappedIO(512)
+            mem.map_address_in(510, lambda addr: 6)
+            mem.map_address_out(511, lambda addr, value: outputs.append(value))
+            load_obj("fact.obj", mem)
+            engine(mem).run()
+            self.assertEqual(outputs, [720])
+            reference = Memory(512)
+            load_obj("fact.obj", reference)
+            self.assertEqual(mem.dump()[:10], reference.dump()[:10])
+
+class TestObjectFile(unittest.TestCase):
+    """Binary object files load the same words as text ones"""
+
+    def test_convert_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            binary = os.path.join(tmp, "sum.dobj")
+            objfile.convert(os.path.join(PROGRAMS, "sum.obj"), binary)
+            from_text = Memory(512)
+            load_obj("sum.obj", from_text)
+            for mem in [Memory(512), CompactMemory(512)]:
+                self.assertEqual(objfile.load_program(binary, mem), 0)
+                self.assertEqual(list(mem.dump()), from_text.dump())
+
+    def test_segments_and_entry(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "two.dobj")
+            with open(path, "wb") as f:
+                objfile.write_binary(f, [(4, [1, -2]), (10, [2 ** 31])], entry=4)
+            mem = CompactMemory(16)
+            self.assertEqual(objfile.load_binary(path, mem), 4)
+            self.assertEqual(list(mem.dump())[3:11],
+                             [0, 1, -2, 0, 0, 0, 0, -2 ** 31])
+
+    def test_rejects_text(self):
+        with self.assertRaises(objfile.ObjectFileError):
+            objfile.load_binary(os.path.join(PROGRAMS, "sum.obj"), Memory())
+
+    def test_rejects_truncated(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "two.dobj")
+            with open(path, "wb") as f:
+                objfile.write_binary(f, [(4, [1, -2]), (10, [2 ** 31])])
+            with open(path, "rb") as f:
+                data = f.read()
+            # Cut into the segment table, and into the words
+            for size in [objfile.HEADER.size + objfile.SEGMENT.size + 4, len(data) - 2]:
+                with open(path, "wb") as f:
+                    f.write(data[:size])
+                with self.assertRaises(objfile.ObjectFileError):
+                    objfile.load_binary(path, Memory(16))
+
+class TestBatch(unittest.TestCase):
+    """Batch jobs run with input and output tapes"""
+
+    def test_run_job(self):
+        job = {"objfile": os.path.join(PROGRAMS, "sum.obj"),
+               "input": [3, 4, 0]}
+        result = batch.run_job(job)
+        self.assertEqual(result["output"], [7])
+        self.assertEqual(result["halt"], "halted")
+        self.assertGreater(result["steps"], 0)
+        job["input"] = [3, 4]
+        self.assertEqual(batch.run_job(job)["halt"], "end of input")
+
+    def test_manifest(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest = os.path.join(tmp, "jobs.jsonl")
+            with open(manifest, "w") as f:
+                for n in range(1, 5):
+                    job = {"objfile": os.path.join(PROGRAMS, "fact.obj"),
+                           "input": [n]}
+                    f.write(json.dumps(job) + "\n")
+            results = batch.run_batch(batch.read_manifest(manifest), 2)
+        self.assertEqual([r["output"] for r in results], [[1], [2], [6], [24]])
+
+class TestDevices(unittest.TestCase):
+    """Buffered memory-mapped devices"""
+
+    def test_run_with_devices(self):
+        batches = [ ]
+        device_in = devices.InputDevice(iter([4, 5, 6, 0]))
+        device_out = devices.OutputDevice(batches.append, batch_size=2)
+        mem = MemoryMappedIO(512)
+        devices.attach(mem, device_in, device_out)
+        load_obj("sum.obj", mem)
+        ThreadedCPU(mem).run()
+        self.assertEqual(batches, [ ])
+        device_out.flush()
+        self.assertEqual(batches, [[15]])
+
+    def test_batches_and_end_of_input(self):
+        batches = [ ]
+        device_out = devices.OutputDevice(batches.append, batch_size=2)
+        for value in range(5):
+            device_out.write(511, value)
+        device_out.flush()
+        self.assertEqual(batches, [[0, 1], [2, 3], [4]])
+        device_in = devices.InputDevice()
+        device_in.feed([7])
+        device_in.close()
+        self.assertEqual(device_in.read(510), 7)
+        for _ in range(2):
+            with self.assertRaises(EOFError):
+                device_in.read(510)
+
+    def test_read_ints_skips_bad_lines(self):
+        lines = io.StringIO("3\n\nfour\n -5 \n")
+        with self.assertLogs(devices.log, "WARNING") as logged:
+            self.assertEqual(list(devices.read_ints(lines)), [3, -5])
+        self.assertIn("line 3", logged.output[0])
+
+class TestProfiler(unittest.TestCase):
+
+    def test_counts(self):
+        mem = Memory(64)
+        mem.load_words(SELF_MODIFYING)
+        cpu = CPU(mem)
+        profiler = Profiler(cpu)
+        cpu.run()
+        self.assertEqual(profiler.steps, cpu.step_count)
+        self.assertEqual(profiler.executed[2], 2)
+        self.assertEqual(profiler.op_counts[OpCode.STORE], 2)
+        self.assertEqual(profiler.writes[2], 2)
+        self.assertEqual(profiler.data_reads(8), 1)
+        self.assertIn("STORE", profiler.report())
+        profiler.detach()
+        self.assertEqual(cpu.listeners, [ ])
+
+class TestCheckpoint(unittest.TestCase):
+    """Runs can be sliced, saved, and resumed"""
+
+    def test_resume_from_checkpoint(self):
+        for cpu_class in [CPU, ThreadedCPU]:
+            outputs = [ ]
+            mem = io_memory([6], outputs)
+            load_obj("fact.obj", mem)
+            cpu = cpu_class(mem)
+            cpu.run(max_steps=20)
+            self.assertEqual(cpu.step_count, 20)
+            self.assertFalse(cpu.halted)
+            blob = cpu.checkpoint()
+            # Finish the original run, then replay the rest from the blob
+            cpu.run(from_addr=None)
+            expected = machine_state(cpu)
+            resumed_outputs = [ ]
+            other = cpu_class(io_memory([ ], resumed_outputs))
+            other.restore(blob)
+            while not other.halted:
+                other.run(from_addr=None, max_steps=7)
+            self.assertEqual(machine_state(other), expected)
+            self.assertEqual(resumed_outputs, outputs)
+
+    def test_wide_values(self):
+        """Python ints beyond 64 bits survive a checkpoint"""
+        mem = io_memory([21], [ ])
+        load_obj("fact.obj", mem)
+        cpu = CPU(mem)
+        cpu.run()
+        self.assertEqual(mem.get(20), 51090942171709440000)
+        cpu.registers[3].put(-2 ** 70 - 5)
+        cpu.registers[4].put(2 ** 63)
+        other = CPU(MemoryMappedIO(512))
+        other.restore(cpu.checkpoint())
+        self.assertEqual(machine_state(other), machine_state(cpu))
+
+    def test_sparse_memory(self):
+        """Only allocated pages of a PagedMemory are saved"""
+        mem = PagedMemory(2 ** 30)
+        mem.load_words(SELF_MODIFYING)
+        mem.put(2 ** 29 + 3, -7)
+        cpu = CPU(mem)
+        cpu.run(max_steps=5)
+        blob = cpu.checkpoint()
+        self.assertLess(len(blob), 1000)
+        other = CPU(PagedMemory(2 ** 30))
+        other.memory.put(5000, 1)    # Not in the checkpoint
+        other.restore(blob)
+        self.assertEqual(other.memory.pages_allocated, 2)
+        self.assertEqual([other.memory.get(addr) for addr in [2, 5000, 2 ** 29 + 3]],
+                         [mem.get(2), 0, -7])
+        self.assertEqual(other.registers.values, cpu.registers.values)
+        # A dense memory restores from the sparse checkpoint too
+        dense = CPU(CompactMemory(64))
+        dense.restore(CPU(PagedMemory(64, page_size=16)).checkpoint())
+        self.assertEqual(list(dense.memory.dump()), 64 * [0])
+
+    def test_capacity_must_match(self):
+        blob = CPU(Memory(64)).checkpoint()
+        with self.assertRaises(ValueError):
+            CPU(Memory(128)).restore(blob)
+
+@unittest.skipUnless(numpy, "lockstep evaluation requires NumPy")
+class TestLockstep(unittest.TestCase):
+    """Lockstep machines agree with separate batch runs"""
+
+    def test_matches_batch_runs(self):
+        tapes = [[3, 4, 0], [0], [5, -2, 9, 0], [1, 2], [ ]]
+        with open(os.path.join(PROGRAMS, "sum.obj")) as f:
+            program = objfile.read_text(f)
+        machines = lockstep.LockstepMachines(program, tapes)
+        machines.run()
+        statuses = {"halted": lockstep.HALTED,
+                    "end of input": lockstep.END_OF_INPUT}
+        for index, tape in enumerate(tapes):
+            result = batch.run_job({"objfile": os.path.join(PROGRAMS, "sum.obj"),
+                                    "input": tape})
+            self.assertEqual(machines.outputs[index], result["output"])
+            self.assertEqual(machines.status[index], statuses[result["halt"]])
+            self.assertEqual(machines.steps[index], result["steps"])
+
+    def test_divide_by_zero(self):
+        program = assemble(
+            Instruction(OpCode.LOAD, CondFlag.ALWAYS, 1, 0, 0, 510),
+            Instruction(OpCode.DIV, CondFlag.ALWAYS, 2, 0, 1, 12),
+            Instruction(OpCode.HALT, CondFlag.ALWAYS, 0, 0, 0, 0))
+        machines = lockstep.LockstepMachines(program, [[-12], [-6], [2]])
+        machines.run()
+        self.assertEqual(list(machines.status),
+                         [lockstep.OVERFLOW, lockstep.HALTED, lockstep.HALTED])
+        self.assertEqual(list(machines.regs[:, 2]), [0, 0, 0])
+        self.assertEqual(machines.condition(0), CondFlag.V)
+
+@unittest.skipUnless(numpy, "array bitfields require NumPy")
+class TestDecodeImage(unittest.TestCase):
+    """Whole-image decode and encode agree with decode and encode"""
+
+    def test_round_trip(self):
+        words = [ ]
+        for name in ["sum.obj", "fact.obj", "max.obj", "count10.obj"]:
+            with open(os.path.join(PROGRAMS, name)) as f:
+                words += [word for word in objfile.read_text(f) if word]
+        fields = decode_image(numpy.array(words, dtype=numpy.int64))
+        for index, word in enumerate(words):
+            instr = decode(word)
+            self.assertEqual(fields["op"][index], instr.op.value)
+            self.assertEqual(fields["cond"][index], instr.cond.value)
+            self.assertEqual(fields["reg_target"][index], instr.reg_target)
+            self.assertEqual(fields["reg_src1"][index], instr.reg_src1)
+            self.assertEqual(fields["reg_src2"][index], instr.reg_src2)
+            self.assertEqual(fields["offset"][index], instr.offset)
+        encoded = encode_image(**fields)
+        self.assertEqual(list(encoded), [decode(word).encode() for word in words])
+
+class TestThreadedCPU(unittest.TestCase):
+    """The threaded engine must leave the same state as CPU.step"""
+    engine = ThreadedCPU
+
+    def assertSameRun(self, words: list = None, obj: str = None,
+                      inputs: list = (), max_steps: int = None):
+        states = [ ]
+        for cpu_class in [CPU, self.engine]:
+            outputs = [ ]
+            mem = io_memory(inputs, outputs)
+            if obj:
+                load_obj(obj, mem)
+            else:
+                mem.load_words(words)
+            cpu = cpu_class(mem)
+            cpu.run(max_steps=max_steps)
+            states.append((machine_state(cpu), outputs, cpu.step_count))
+        self.assertEqual(states[0], states[1])
+
+    def test_sample_programs(self):
+        self.assertSameRun(obj="sum.obj", inputs=[3, 7, 12, 0])
+        self.assertSameRun(obj="fact.obj", inputs=[6])
+        self.assertSameRun(obj="max.obj", inputs=[4, 9])
+        self.assertSameRun(obj="count10.obj")
+
+    def test_self_modifying(self):
+        self.assertSameRun(SELF_MODIFYING)
+
+    def test_divide_by_zero(self):
+        self.assertSameRun(assemble(
+            Instruction(OpCode.ADD, CondFlag.ALWAYS, 1, 0, 0, 7),
+            Instruction(OpCode.DIV, CondFlag.ALWAYS, 2, 1, 0, 0),
+            Instruction(OpCode.ADD, CondFlag.ALWAYS, 3, 0, 0, 1)))
+
+    def test_step_budget(self):
+        for max_steps in [1, 5, 13, 40]:
+            self.assertSameRun(obj="fact.obj", inputs=[5], max_steps=max_steps)
+
+    def test_segfault(self):
+        words = assemble(
+            Instruction(OpCode.ADD, CondFlag.ALWAYS, 1, 0, 0, 3),
+            Instruction(OpCode.LOAD, CondFlag.ALWAYS, 2, 0, 0, -1),
+            Instruction(OpCode.ADD, CondFlag.ALWAYS, 3, 0, 0, 1))
+        for cpu_class in [CPU, self.engine]:
+            cpu = cpu_class(Memory(16))
+            cpu.memory.load_words(words)
+            with self.assertRaises(SegFault):
+                cpu.run()
+            self.assertEqual(cpu.step_count, 1)
+            self.assertEqual(cpu.registers[15].get(), 2)
+            self.assertEqual(cpu.registers[1].get(), 3)
+            self.assertEqual(cpu.condition, CondFlag.M)
+
+class TestBlockCPU(TestThreadedCPU):
+    """Basic blocks must leave the same state as CPU.step"""
+    engine = BlockCPU
+
+    def interrupted(self, error: BaseException) -> CPU:
+        """Run a block whose third instruction reads a hook raising error"""
+        def hook(addr: int) -> int:
+            raise error
+        mem = MemoryMappedIO(64)
+        mem.map_address_in(40, hook)
+        mem.load_words(assemble(
+            Instruction(OpCode.ADD, CondFlag.ALWAYS, 1, 0, 0, 3),
+            Instruction(OpCode.DIV, CondFlag.ALWAYS, 2, 1, 0, 2),
+            Instruction(OpCode.LOAD, CondFlag.ALWAYS, 3, 0, 0, 40),
+            Instruction(OpCode.ADD, CondFlag.ALWAYS, 4, 0, 0, 1),
+            Instruction(OpCode.HALT, CondFlag.ALWAYS, 0, 0, 0, 0)))
+        cpu = self.engine(mem)
+        with self.assertRaises(type(error)):
+            cpu.run()
+        return cpu
+
+    def test_exception_in_block(self):
+        """State stops at the instruction that raised"""
+        cpu = self.interrupted(RuntimeError("device failed"))
+        self.assertEqual(cpu.step_count, 2)
+        self.assertEqual(cpu.registers.values[:5], [0, 3, 1, 0, 0])
+        self.assertEqual(cpu.registers[15].get(), 3)
+
+    def test_interrupt_in_block(self):
+        """A KeyboardInterrupt leaves the state the block began with"""
+        cpu = self.interrupted(KeyboardInterrupt())
+        self.assertEqual(cpu.step_count, 0)
+        self.assertEqual(cpu.registers.values[:5], [0, 0, 0, 0, 0])
+        self.assertEqual(cpu.registers[15].get(), 0)
+
+class TestAssembler(unittest.TestCase):
+    """Assembled programs should decode like their object files"""
+
+    def assemble_file(self, name: str) -> list:
+        with open(os.path.join(PROGRAMS, name)) as f:
+            return assembler.assemble(f.readlines())
+
+    def test_programs(self):
+        for name in ["count10", "fact", "max", "sum", "two_ten"]:
+            with open(os.path.join(PROGRAMS, name + ".obj")) as f:
+                expected = objfile.read_text(f)
+            for ext in [".asm", ".dasm"]:
+                words = self.assemble_file(name + ext)
+                self.assertEqual([str(decode(w)) for w in words],
+                                 [str(decode(w)) for w in expected], name + ext)
+
+    def test_printed_instructions(self):
+        instr = Instruction(OpCode.SUB, CondFlag.M | CondFlag.Z, 2, 1, 3, -12)
+        self.assertEqual(assembler.assemble([str(instr), "DATA -4"]),
+                         [instr.encode(), -4])
+
+    def test_errors(self):
+        with self.assertRaises(assembler.AssemblyError) as context:
+            self.assemble_file("bad_label.asm")
+        self.assertEqual(context.exception.line_num, 2)
+        for line in ["ADD r1,r2", "FOO r1,r2,r3", "ADD/Q r1,r2,r3", "ADD r1,r0,r0[600]"]:
+            with self.assertRaises(assembler.AssemblyError):
+                assembler.assemble([line])
+
+    def test_reassemble(self):
+        with open(os.path.join(PROGRAMS, "fact.asm")) as f:
+            source = f.readlines()
+        asm = assembler.Assembler()
+        words = asm.assemble(source)
+        first = asm.encodings
+        # Changing one line that no label reference crosses
+        source[-1] = "const1_3:  DATA 2\n"
+        edited = asm.assemble(source)
+        self.assertEqual(asm.encodings, first + 1)
+        self.assertEqual(edited[:-1], words[:-1])
+        self.assertEqual(edited, assembler.assemble(source))
+
+    def test_lowercase(self):
+        source = ["loop: LOAD r1,x", "JUMP/P loop", "ADD/Z r1,r2,r3[4]", "x: DATA 7"]
+        lower = ["loop: load r1,x", "jump/p loop", "add/z r1,r2,r3[4]", "x: data 7"]
+        self.assertEqual(assembler.assemble(lower), assembler.assemble(source))
+
+    def test_bounded_caches(self):
+        with open(os.path.join(PROGRAMS, "fact.asm")) as f:
+            source = f.readlines()
+        asm = assembler.Assembler(cache_size=4)
+        words = asm.assemble(source)
+        self.assertLessEqual(len(asm.parsed), 4)
+        self.assertLessEqual(len(asm.encoded), 4)
+        self.assertEqual(asm.assemble(source), words)
+
+class TestTrace(unittest.TestCase):
+    """Traces record each step and replay to the same state"""
+
+    def traced_run(self, capacity: int) -> tuple:
+        outputs = [ ]
+        mem = io_memory([5], outputs)
+        load_obj("fact.obj", mem)
+        cpu = ThreadedCPU(mem)
+        cpu.trace = tracing.Trace(capacity)
+        cpu.run()
+        return cpu, mem
+
+    def test_replay(self):
+        cpu, mem = self.traced_run(4096)
+        self.assertEqual(cpu.trace.recorded, cpu.step_count)
+        with tempfile.TemporaryFile() as f:
+            cpu.trace.write(f)
+            f.seek(0)
+            records = list(tracing.read_trace(f))
+        self.assertEqual(records, cpu.trace.records())
+        self.assertEqual(records[0].pc, 0)
+        self.assertEqual(records[0].dest, 1)
+        self.assertEqual(records[0].addr, 510)
+        self.assertEqual(records[0].result, 5)   # Read from the console
+        self.assertEqual(records[-1].dest, tracing.NO_DEST)  # HALT
+        replayed = CPU(Memory(512))
+        load_obj("fact.obj", replayed.memory)
+        steps = [ ]
+        class Listener(MVCListener):
+            def notify(self, event):
+                steps.append(event.pc_addr)
+        replayed.register_listener(Listener())
+        tracing.replay(records, replayed)
+        self.assertEqual(steps, [record.pc for record in records])
+        self.assertEqual(machine_state(replayed)[:3], machine_state(cpu)[:3])
+        # Except for the console, which the replay stores to
+        self.assertEqual(replayed.memory._mem[:510], mem._mem[:510])
+        self.assertEqual(replayed.memory.get(511), 120)
+
+    def test_ring(self):
+        cpu, mem = self.traced_run(10)
+        records = cpu.trace.records()
+        self.assertEqual(len(records), 10)
+        self.assertEqual(records, self.traced_run(4096)[0].trace.records()[-10:])
+
+    def test_replay_after_wrap(self):
+        """Stores replay their recorded value, even when the step
+        that computed it has left the ring
+        """
+        mem = Memory(64)
+        mem.load_words(assemble(
+            Instruction(OpCode.ADD, CondFlag.ALWAYS, 1, 0, 0, 7),
+            *[Instruction(OpCode.ADD, CondFlag.ALWAYS, 2, 2, 0, 1)] * 10,
+            Instruction(OpCode.STORE, CondFlag.ALWAYS, 1, 0, 0, 40),
+            Instruction(OpCode.HALT, CondFlag.ALWAYS, 0, 0, 0, 0)))
+        cpu = CPU(mem)
+        cpu.trace = tracing.Trace(5)
+        cpu.run()
+        self.assertEqual(mem.get(40), 7)
+        records = cpu.trace.records()
+        self.assertEqual(len(records), 5)
+        self.assertEqual((records[-2].addr, records[-2].result), (40, 7))
+        replayed = CPU(Memory(64))
+        tracing.replay(records, replayed)
+        self.assertEqual(replayed.memory.get(40), 7)
+
+class TestDebugger(unittest.TestCase):
+    """Breakpoints and watchpoints stop the threaded engine"""
+
+    def debugger(self, outputs: list) -> Debugger:
+        mem = io_memory([5], outputs)
+        load_obj("fact.obj", mem)
+        return Debugger(ThreadedCPU(mem))
+
+    def test_breakpoint(self):
+        debug = self.debugger([ ])
+        debug.add_breakpoint(7)
+        self.assertEqual(debug.cont(), Stop("breakpoint", 7))
+        self.assertEqual(debug.state()["pc"], 7)
+        self.assertEqual(debug.steps, 7)
+        # Continuing runs the instruction at the breakpoint, then
+        # stops there again on the next iteration of the loop
+        self.assertEqual(debug.cont(), Stop("breakpoint", 7))
+        self.assertEqual(debug.steps, 19)
+        self.assertEqual(debug.step(2).reason, "steps")
+        self.assertEqual(debug.state()["pc"], 9)
+        debug.remove_breakpoint(7)
+        self.assertEqual(debug.cont(), Stop("halted"))
+
+    def test_watchpoints(self):
+        outputs = [ ]
+        debug = self.debugger(outputs)
+        debug.watch(20, 23, read=False)
+        self.assertEqual(debug.cont(), Stop("write", 20, 1))
+        self.assertEqual(debug.state()["pc"], 4)
+        debug.unwatch(20, 23)
+        # Chained to the console hook, which still sees the value
+        debug.watch(511)
+        self.assertEqual(debug.cont(), Stop("write", 511, 120))
+        self.assertEqual(outputs, [120])
+        self.assertEqual(debug.cont(), Stop("halted"))
+        self.assertEqual(debug.words(19, 21), [(19, 0), (20, 120)])
+
+    def test_with_listener(self):
+        debug = self.debugger([ ])
+        listener = MVCListener()
+        listener.notify = lambda event: None
+        debug.cpu.register_listener(listener)
+        debug.add_breakpoint(7)
+        debug.watch(511)
+        self.assertEqual(debug.cont(), Stop("breakpoint", 7))
+        self.assertEqual(debug.cont(), Stop("breakpoint", 7))
+        debug.remove_breakpoint(7)
+        self.assertEqual(debug.cont(), Stop("write", 511, 120))
+        self.assertEqual(debug.cont(), Stop("halted"))
+        self.assertEqual(debug.steps, 70)
+
+    def test_inspection_is_silent(self):
+        """Reading words neither notifies listeners nor runs hooks"""
+        inputs = [ ]
+        mem = MemoryMappedIO(512)
+        mem.map_address_in(510, lambda addr: inputs.append(addr) or 5)
+        load_obj("fact.obj", mem)
+        events = [ ]
+        listener = MVCListener()
+        listener.notify = events.append
+        mem.register_listener(listener)
+        debug = Debugger(ThreadedCPU(mem))
+        debug.watch(19, 21)
+        self.assertEqual(debug.words(18, 22)[-1], (21, mem.peek(21)))
+        self.assertEqual(debug.words(510, 511), [(510, 0)])
+        self.assertEqual(debug.state()["next"], str(decode(mem.peek(0))))
+        self.assertEqual((events, inputs), ([ ], [ ]))
+        paged = PagedMemory(1 << 20)
+        paged.put(70000, 3)
+        self.assertEqual((paged.peek(70000), paged.peek(5)), (3, 0))
+
+class TestBench(unittest.TestCase):
+    """Benchmarks run on every engine and find slowdowns"""
+
+    def test_small_run(self):
+        run = bench.run_benchmarks(scale=0.01, repeat=1)
+        self.assertEqual(set(run["results"]), set(bench.PROGRAMS))
+        for name, engines in run["results"].items():
+            self.assertEqual(set(engines), set(bench.ENGINES))
+            steps = {r["steps"] for r in engines.values()}
+            self.assertEqual(len(steps), 1, name)
+        self.assertGreater(run["results"]["memcopy"]["CPU"]["mops"], 0)
+        json.dumps(run)
+        self.assertEqual(bench.compare(run, run), [ ])
+        slower = json.loads(json.dumps(run))
+        slower["results"]["io"]["CPU"]["ips"] /= 2
+        self.assertEqual(len(bench.compare(run, slower)), 1)
+
+# Each core sums its quarter of the words at 100..115 into 200 + its
+# core number, then sets a done flag at 210 + its core number.  Core
+# 0 waits for the others, adds up the partial sums, and prints.
+PARALLEL_SUM = [
+    "   LOAD  r1,r0,r0[509]    # core number",
+    "   MUL   r2,r1,r0[4]",
+    "   ADD   r2,r2,r0[100]    # first word of this core",
+    "   ADD   r3,r0,r0[4]      # words left",
+    "loop:",
+    "   LOAD  r4,r2,r0[0]",
+    "   ADD   r5,r5,r4",
+    "   ADD   r2,r2,r0[1]",
+    "   SUB   r3,r3,r0[1]",
+    "   JUMP/P loop",
+    "   STORE r5,r1,r0[200]",
+    "   ADD   r6,r0,r0[1]",
+    "   STORE r6,r1,r0[210]",
+    "   SUB   r0,r1,r0",
+    "   HALT/P r0,r0,r0",
+    "   ADD   r7,r0,r0[1]      # core to wait for",
+    "wait:",
+    "   LOAD  r6,r7,r0[210]",
+    "   SUB   r0,r6,r0",
+    "   JUMP/Z wait",
+    "   LOAD  r6,r7,r0[200]",
+    "   ADD   r5,r5,r6",
+    "   ADD   r7,r7,r0[1]",
+    "   SUB   r0,r7,r0[4]",
+    "   JUMP/M wait",
+    "   STORE r5,r0,r0[511]",
+    "   HALT  r0,r0,r0",
+    ]
+
+class TestMultiCore(unittest.TestCase):
+    """Cores share memory and are scheduled round robin"""
+
+    def run_sum(self, engine, quantum: int) -> tuple:
+        outputs = [ ]
+        mem = io_memory([ ], outputs)
+        mem.load_words(assembler.assemble(PARALLEL_SUM))
+        mem.load_words(list(range(1, 17)), 100)
+        machine = multicore.MultiCore(mem, 4, engine, quantum)
+        machine.run()
+        return machine, outputs
+
+    def test_parallel_sum(self):
+        machine, outputs = self.run_sum(CPU, 1)
+        self.assertEqual(outputs, [136])
+        self.assertEqual(machine.faults, { })
+        self.assertEqual(machine.steps[1], machine.steps[2])
+        self.assertGreater(machine.steps[0], machine.steps[1])
+        self.assertEqual(machine.makespan(), machine.steps[0])
+        self.assertEqual(machine.bus.port(3).writes, 2)
+        self.assertIn("Speedup", machine.report(4 * machine.steps[1]))
+
+    def test_deterministic(self):
+        first, _ = self.run_sum(CPU, 3)
+        second, outputs = self.run_sum(ThreadedCPU, 3)
+        self.assertEqual(outputs, [136])
+        self.assertEqual(first.steps, second.steps)
+
+    def test_code_kept_between_slices(self):
+        reference, _ = self.run_sum(CPU, 1)
+        for engine in [ThreadedCPU, BlockCPU]:
+            machine, outputs = self.run_sum(engine, 1)
+            self.assertEqual(outputs, [136])
+            self.assertEqual(machine.steps, reference.steps)
+            # Instructions are fetched when compiled, not on every slice
+            reads = [port.reads for port in machine.bus.ports]
+            self.assertLess(reads[1], reference.bus.port(1).reads, engine.__name__)
+
+    def test_code_written_by_other_core(self):
+        source = [
+            "   LOAD  r1,r0,r0[509]",
+            "   SUB   r0,r1,r0",
+            "   JUMP/P writer",
+            "flag:",
+            "   ADD   r2,r0,r0[0]    # core 1 makes this ADD r2,r0,r0[1]",
+            "   SUB   r0,r2,r0",
+            "   JUMP/Z flag",
+            "   STORE r2,r0,r0[511]",
+            "   HALT  r0,r0,r0",
+            "writer:",
+            "   LOAD  r3,new",
+            "   STORE r3,flag",
+            "   HALT  r0,r0,r0",
+            "new:",
+            "   ADD   r2,r0,r0[1]",
+            ]
+        for engine in [ThreadedCPU, BlockCPU]:
+            outputs = [ ]
+            mem = io_memory([ ], outputs)
+            mem.load_words(assembler.assemble(source))
+            machine = multicore.MultiCore(mem, 2, engine, quantum=2)
+            machine.run(max_rounds=100)
+            self.assertEqual(outputs, [1], engine.__name__)
+            self.assertEqual(machine.running(), [ ])
+
+    def test_fault_stops_one_core(self):
+        source = ["LOAD r1,r0,r0[509]", "SUB r0,r1,r0", "HALT/Z r0,r0,r0",
+                  "LOAD r2,r0,r0[510]", "HALT r0,r0,r0"]
+        for engine in [CPU, ThreadedCPU, BlockCPU]:
+            mem = io_memory([ ], [ ])    # Reading input raises StopIteration
+            mem.load_words(assembler.assemble(source))
+            machine = multicore.MultiCore(mem, 3, engine)
+            machine.run()
+            self.assertTrue(machine.cores[0].halted)
+            self.assertEqual(sorted(machine.faults), [1, 2])
+            self.assertIsInstance(machine.faults[1], StopIteration)
+
+class TestCache(unittest.TestCase):
+    """Caches count hits and misses without changing results"""
+
+    def test_same_results(self):
+        expected = None
+        for ways, policy, write_back in [(1, "lru", True), (2, "fifo", False),
+                                         (4, "lru", False), (2, "lru", True)]:
+            outputs = [ ]
+            mem = io_memory([5], outputs)
+            load_obj("fact.obj", mem)
+            cache = Cache(mem, size=16, line_size=2, ways=ways, policy=policy,
+                          write_back=write_back)
+            cpu = CPU(cache)
+            cpu.run()
+            self.assertEqual(outputs, [120])
+            self.assertEqual(cache.uncached, 2)   # Console input and output
+            self.assertGreater(cache.hit_rate(), 0.5)
+            state = ([reg.get() for reg in cpu.registers], cache.dump())
+            if expected is None:
+                expected = state
+            self.assertEqual(state, expected)
+
+    def test_policies(self):
+        mem = Memory(64)
+        mem.load_words(range(64))
+        # Lines 0 and 2 conflict in a direct-mapped cache of two lines
+        direct = Cache(mem, size=8, line_size=4, ways=1)
+        self.assertEqual([direct.get(addr) for addr in [0, 8, 1, 9]], [0, 8, 1, 9])
+        self.assertEqual((direct.hits, direct.misses), (0, 4))
+        both = Cache(mem, size=8, line_size=4, ways=2)
+        for addr in [0, 8, 1, 9]:
+            both.get(addr)
+        self.assertEqual((both.hits, both.misses), (2, 2))
+        # Lines A, B, A, C, A in one set of two ways
+        for policy, hits in [("lru", 2), ("fifo", 1)]:
+            cache = Cache(mem, size=8, line_size=4, ways=2, policy=policy)
+            for addr in [0, 4, 0, 8, 0]:
+                cache.get(addr)
+            self.assertEqual(cache.hits, hits, policy)
+
+    def test_writes(self):
+        mem = Memory(64)
+        back = Cache(mem, size=8, line_size=4, ways=1, memory_time=10)
+        back.put(5, 99)
+        self.assertEqual(mem.get(5), 0)
+        self.assertEqual(back.get(5), 99)
+        back.get(13)    # Evicts the dirty line
+        self.assertEqual(mem.get(5), 99)
+        self.assertEqual(back.cycles, 3 * 1 + 3 * 10)
+        through = Cache(mem, size=8, line_size=4, ways=1, write_back=False)
+        through.put(6, 42)
+        self.assertEqual(mem.get(6), 42)
+        self.assertEqual(through.misses, 1)
+        self.assertEqual(sum(len(s) for s in through.sets), 0)
+
+    def test_events(self):
+        mem = Memory(64)
+        cache = Cache(mem, size=4, line_size=4)
+        events = [ ]
+        listener = MVCListener()
+        listener.notify = events.append
+        cache.register_listener(listener)
+        cache.get(1)
+        cache.put(2, 7)
+        cache.get(4)
+        self.assertEqual([type(e) for e in events], [CacheMiss, CacheHit, CacheEvict, CacheMiss])
+        self.assertEqual((events[0].line, events[0].size), (0, 4))
+        self.assertEqual(mem.get(2), 7)
+
+    def test_engines_agree(self):
+        stats = [ ]
+        for engine in [CPU, ThreadedCPU, BlockCPU]:
+            outputs = [ ]
+            mem = io_memory([10], outputs)
+            load_obj("fact.obj", mem)
+            cache = Cache(mem, 64, 4, 2)
+            engine(cache).run()
+            self.assertEqual(outputs, [3628800])
+            stats.append((cache.hits, cache.misses, cache.uncached, cache.cycles))
+        self.assertEqual(stats[0][0], 199)
+        self.assertEqual(stats[0][3], 365)
+        self.assertEqual(stats[1], stats[0])
+        self.assertEqual(stats[2], stats[0])
+
+    def test_profiled(self):
+        outputs = [ ]
+        mem = io_memory([5], outputs)
+        load_obj("fact.obj", mem)
+        cache = Cache(mem, 64, 4, 2)
+        cpu = CPU(cache)
+        profiler = Profiler(cpu)
+        cpu.run()
+        # Every instruction fetch, data access, and console access
+        self.assertEqual(sum(profiler.reads.values()) + sum(profiler.writes.values()),
+                         cache.accesses())
+        self.assertEqual(profiler.reads[510], 1)
+        self.assertEqual(profiler.writes[511], 1)
+        self.assertEqual(profiler.data_reads(0), 0)
+
+    def test_peek(self):
+        mem = Memory(64)
+        mem.load_words(range(64))
+        cache = Cache(mem, size=8, line_size=4, ways=1)
+        cache.put(5, 99)    # Only in the cached line
+        self.assertEqual((cache.peek(5), cache.peek(6), cache.peek(40)), (99, 6, 40))
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        with self.assertRaises(SegFault):
+            cache.peek(64)
+        debug = Debugger(CPU(cache))
+        self.assertEqual(debug.words(4, 6), [(4, 4), (5, 99)])
+
+class TestPipeline(unittest.TestCase):
+    """Pipeline timing counts hazards and stalls"""
+
+    def pipeline(self, words: list, **options) -> Pipeline:
+        mem = Memory(64)
+        mem.load_words(words)
+        cpu = CPU(mem)
+        pipeline = Pipeline(cpu, **options)
+        cpu.run()
+        return pipeline
+
+    def test_data_hazards(self):
+        words = assemble(
+            Instruction(OpCode.LOAD, CondFlag.ALWAYS, 1, 0, 0, 10),
+            Instruction(OpCode.ADD, CondFlag.ALWAYS, 2, 1, 0, 1),    # load-use
+            Instruction(OpCode.ADD, CondFlag.ALWAYS, 3, 2, 0, 1),
+            Instruction(OpCode.HALT, CondFlag.ALWAYS, 0, 0, 0, 0))
+        forwarded = self.pipeline(words)
+        self.assertEqual((forwarded.data_hazards, forwarded.load_use), (2, 1))
+        self.assertEqual(forwarded.cycles(), 4 + 4 + 1)
+        stalled = self.pipeline(words, forwarding=False)
+        self.assertEqual(stalled.data_stalls, 4)
+        self.assertEqual(stalled.cycles(), 4 + 4 + 4)
+        self.assertEqual(stalled.stalls_at, {1: 2, 2: 2})
+
+    def test_control_hazards(self):
+        words = assemble(
+            Instruction(OpCode.ADD, CondFlag.ALWAYS, 1, 0, 0, 3),
+            Instruction(OpCode.SUB, CondFlag.ALWAYS, 1, 1, 0, 1),
+            Instruction(OpCode.ADD, CondFlag.P, 15, 0, 15, -1),      # taken twice
+            Instruction(OpCode.HALT, CondFlag.ALWAYS, 0, 0, 0, 0))
+        pipeline = self.pipeline(words)
+        self.assertEqual(pipeline.instructions, 8)
+        self.assertEqual(pipeline.control_hazards, 2)
+        self.assertEqual(pipeline.control_stalls, 4)
+        self.assertEqual(pipeline.cycles(), 8 + 4 + 4)
+        self.assertIn("CPI 2.00", pipeline.report())
+        # ADD/P reads the flags of the SUB before it:  forwarded
+        # in time, but read from WB without forwarding
+        self.assertEqual((pipeline.data_hazards, pipeline.data_stalls), (1 + 3, 0))
+        stalled = self.pipeline(words, forwarding=False)
+        self.assertEqual(stalled.data_stalls, 2 + 3 * 2)
+        self.assertEqual(stalled.stalls_at, {1: 2 + 4, 2: 6})
+        self.assertEqual(stalled.cycles(), 8 + 4 + 4 + 8)
+
+class SignlessALU(ALU):
+    """Subtracts the magnitude of a negative operand"""
+    def exec(self, op: OpCode, in1: int, in2: int):
+        if op is OpCode.SUB:
+            in2 = abs(in2)
+        return super().exec(op, in1, in2)
+
+class SignlessCPU(CPU):
+    def __init__(self, memory: Memory):
+        super().__init__(memory)
+        self.alu = SignlessALU()
+
+class TestDiffTest(unittest.TestCase):
+    """Engines agree with CPU.step in lockstep, and a broken
+    engine is reduced to a minimal counterexample
+    """
+
+    def test_engines_agree(self):
+        for engine in difftest.ENGINES.values():
+            self.assertIsNone(difftest.check(difftest.random_cases(50, seed=1), engine))
+            self.assertIsNone(difftest.check(difftest.corpus_cases(), engine))
+
+    def test_faults_compared(self):
+        case = difftest.Case(tuple(assemble(
+            Instruction(OpCode.ADD, CondFlag.ALWAYS, 1, 0, 0, 3),
+            Instruction(OpCode.STORE, CondFlag.ALWAYS, 1, 0, 0, 40),
+            Instruction(OpCode.LOAD, CondFlag.ALWAYS, 2, 0, 0, -1))))
+        states, fault = difftest.reference(case)
+        self.assertEqual(len(states), 3)
+        self.assertEqual(states[2].writes, ((40, 3),))
+        self.assertEqual((fault.steps, fault.fault), (2, "SegFault"))
+        for stride in difftest.STRIDES:
+            self.assertIsNone(difftest.compare(case, BlockCPU, stride))
+
+    def test_shrink(self):
+        mismatch = difftest.check(difftest.random_cases(200, seed=3), SignlessCPU)
+        self.assertIsNotNone(mismatch)
+        shrunk = difftest.shrink(mismatch)
+        self.assertEqual(len(shrunk.case.words), 1)
+        self.assertEqual(shrunk.case.max_steps, 1)
+        instr = decode(shrunk.case.words[0])
+        self.assertEqual(instr.op, OpCode.SUB)
+        self.assertLess(instr.offset, 0)
+        self.assertNotEqual(shrunk.expected.registers, shrunk.actual.registers)
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,263 @@
+"""
+Threaded-code execution engine for the Duck Machine.
+
+The first time an instruction is fetched, it is translated into
+a Python closure with its registers, offset, and operation baked
+in.  Running a program is then just a loop calling closures,
+without decode, ALU table lookups, or Register method calls on
+every step.  The resulting register, memory, and condition code
+state is the same as CPU.step would produce.
+"""
+
+from cpu import CPU
+from instr_format import Instruction, OpCode, CondFlag, decode
+from memory import Memory
+from cache import Cache
+
+from operator import add, sub, mul
+from typing import Callable, Dict, List, Optional
+import sys
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# While a program is running, the engine keeps CPU state in a
+# plain list of ints:  the 16 registers, then the condition code,
+# the halted flag, and a scratch slot that takes the place of r0
+# as a target, so that writes to r0 need no test.
+COND = 16
+HALTED = 17
+DISCARD = 18
+
+# Value of the halted slot when a hook (e.g., a debugger watchpoint)
+# asks the engine to stop after the current instruction.  HALT and
+# division by zero set the slot to 1.
+STOPPED = 2
+
+M = CondFlag.M.value
+Z = CondFlag.Z.value
+P = CondFlag.P.value
+V = CondFlag.V.value
+ALWAYS = CondFlag.ALWAYS.value
+
+# A compiled instruction updates the state list, including
+# the program counter r15.
+Thread = Callable[[List[int]], None]
+
+
+def compile_instr(addr: int, instr: Instruction, memory: Memory,
+                  code: Dict[int, Thread]) -> Thread:
+    """Translate the instruction at addr into a closure.
+    code is the table of compiled instructions, from which
+    a STORE removes the entry for the address it writes.
+    """
+    next_addr = addr + 1
+    mask = instr.cond.value
+    if mask == 0:
+        # NEVER: just advance the program counter
+        def skip(regs: List[int]) -> None:
+            regs[15] = next_addr
+        return skip
+    body = _compile_op(next_addr, instr, memory, code)
+    if mask == ALWAYS:
+        return body
+
+    def predicated(regs: List[int]) -> None:
+        if regs[COND] & mask:
+            body(regs)
+        else:
+            regs[15] = next_addr
+    return predicated
+
+
+def _compile_op(next_addr: int, instr: Instruction, memory: Memory,
+                code: Dict[int, Thread]) -> Thread:
+    """The unconditional part of an instruction"""
+    op = instr.op
+    target = instr.reg_target
+    left = instr.reg_src1
+    right = instr.reg_src2
+    offset = instr.offset
+    dest = target or DISCARD
+
+    if op is OpCode.HALT:
+        def halt(regs: List[int]) -> None:
+            regs[COND] = Z
+            regs[HALTED] = 1
+            regs[15] = next_addr
+        return halt
+
+    if op is OpCode.LOAD:
+        get = memory.get
+
+        def load(regs: List[int]) -> None:
+            addr = regs[left] + (regs[right] + offset)
+            regs[COND] = Z if addr == 0 else (P if addr > 0 else M)
+            regs[15] = next_addr
+            regs[dest] = get(addr)
+        return load
+
+    if op is OpCode.STORE:
+        put = memory.put
+        forget = code.pop
+
+        def store(regs: List[int]) -> None:
+            addr = regs[left] + (regs[right] + offset)
+            regs[COND] = Z if addr == 0 else (P if addr > 0 else M)
+            regs[15] = next_addr
+            put(addr, regs[target])
+            # The word at addr may have been a compiled instruction
+            forget(addr, None)
+        return store
+
+    if op is OpCode.DIV:
+        def div(regs: List[int]) -> None:
+            divisor = regs[right] + offset
+            if divisor == 0:
+                regs[COND] = V
+                regs[HALTED] = 1
+                regs[15] = next_addr
+                regs[dest] = 0
+                return
+            result = regs[left] // divisor
+            regs[COND] = Z if result == 0 else (P if result > 0 else M)
+            regs[15] = next_addr
+            regs[dest] = result
+        return div
+
+    fn = { OpCode.ADD: add, OpCode.SUB: sub, OpCode.MUL: mul }[op]
+
+    def arith(regs: List[int]) -> None:
+        result = fn(regs[left], regs[right] + offset)
+        regs[COND] = Z if result == 0 else (P if result > 0 else M)
+        regs[15] = next_addr
+        regs[dest] = result
+    return arith
+
+
+class TrapTable(dict):
+    """A table of compiled code with some entries (traps, e.g.,
+    debugger breakpoints) installed in advance.  A store to a
+    trapped address leaves the trap in place.
+    """
+
+    def __init__(self, traps: Dict[int, Thread]) -> None:
+        super().__init__(traps)
+        self.traps = traps
+
+    def pop(self, addr: int, default=None):
+        if addr in self.traps:
+            return default
+        return super().pop(addr, default)
+
+
+class ThreadedCPU(CPU):
+    """A CPU that runs programs as compiled closures.  It falls
+    back to the reference fetch/decode/execute loop when a view
+    or other listener is attached to the CPU or its memory, when
+    tracing, when memory is a Cache, or in single step mode.
+    Memory-mapped I/O needs no fallback:  loads and stores still
+    go through the memory's get and put, so hooks see exactly the
+    accesses CPU.step would make.
+    """
+
+    def __init__(self, memory: Memory) -> None:
+        super().__init__(memory)
+        # Threads installed in the code table of every run, by address
+        self.traps: Dict[int, Thread] = { }
+        self.stop_requested = False
+        self._state: Optional[List[int]] = None  # State list while running
+        # With keep_code set, compiled code is kept from one run to
+        # the next, e.g., by a scheduler that runs the CPU in short
+        # slices.  Writes to memory by anyone but this CPU must then
+        # be reported with forget_code.
+        self.keep_code = False
+        self._code = None
+
+    def request_stop(self) -> None:
+        """Stop after the current instruction.  For use by memory
+        hooks and traps while the CPU is running.
+        """
+        self.stop_requested = True
+        if self._state is not None and not self._state[HALTED]:
+            self._state[HALTED] = STOPPED
+
+    def forget_code(self, addr: Optional[int]=None) -> None:
+        """Drop kept code compiled from the word at addr, or all kept code"""
+        if self._code is None:
+            return
+        if addr is None:
+            self._code = None
+        else:
+            self._code.pop(addr, None)
+
+    def _new_table(self) -> Dict[int, Thread]:
+        return TrapTable(self.traps) if self.traps else { }
+
+    def _table(self) -> Dict[int, Thread]:
+        """The table of compiled code for a run.  Traps may change
+        between runs, so code is not kept while any are installed.
+        """
+        if not self.keep_code or self.traps:
+            self._code = None
+            return self._new_table()
+        if self._code is None:
+            self._code = self._new_table()
+        return self._code
+
+    def _can_thread(self) -> bool:
+        # Compiled code fetches each instruction once, so a cache
+        # would miss the hits and misses of later fetches
+        return not (self.listeners or self.memory.listeners
+                    or self.trace is not None or isinstance(self.memory, Cache))
+
+    def run(self, from_addr: Optional[int]=0, single_step=False,
+            max_steps: Optional[int]=None) -> None:
+        """Run compiled code until we HALT or take max_steps steps"""
+        if single_step or not self._can_thread():
+            log.debug("Listeners attached; using reference CPU.step")
+            # CPU.step stores do not update the table
+            self._code = None
+            super().run(from_addr, single_step, max_steps)
+            return
+        self.halted = False
+        if from_addr is not None:
+            self.registers[15].put(from_addr)
+        regs = list(self.registers.values)
+        regs += [self.condition.value, 0, 0]
+        self.stop_requested = False
+        self._state = regs
+        try:
+            self._execute(regs, sys.maxsize if max_steps is None else max_steps)
+        finally:
+            self._state = None
+            self.registers.values[1:16] = regs[1:16]
+            self.condition = CondFlag(regs[COND])
+            self.halted = regs[HALTED] == 1
+
+    def _execute(self, regs: List[int], max_steps: int) -> None:
+        """Dispatch loop over compiled instructions"""
+        code = self._table()
+        lookup = code.get
+        steps = 0
+        try:
+            while not regs[HALTED] and steps < max_steps:
+                pc = regs[15]
+                thread = lookup(pc)
+                if thread is None:
+                    thread = self._fetch(pc, code)
+                thread(regs)
+                steps += 1
+        finally:
+            self.step_count = steps
+
+    def _fetch(self, pc: int, code: Dict[int, Thread]) -> Thread:
+        """Fetch and compile the instruction at pc"""
+        word = self.memory.get(pc)
+        thread = compile_instr(pc, decode(word), self.memory, code)
+        # A read hook may return a different word each time
+        if pc not in getattr(self.memory, "hooks_read", {}):
+            code[pc] = thread
+        return thread
@@ -0,0 +1,160 @@
+"""
+Execution traces of the Duck Machine.
+
+A Trace records one fixed-size binary record per CPU step in a
+preallocated ring buffer, so tracing costs one struct.pack_into per
+step and a long run keeps only its most recent steps.  A record is
+
+    pc (i32), instruction word (u32), destination register (i8),
+    memory address (i64), result (i64), condition code after the
+    step (u8)
+
+The destination is the register written by the step, NO_DEST if
+an executed step wrote no register (STORE or HALT), or SKIPPED if
+the step was predicated off.  The result is the value written to
+the register, or to memory by a STORE.  The address is the one a
+LOAD or STORE accessed, and 0 for other steps.  Values wider than
+64 bits are recorded modulo 2^64.
+
+A trace file is a header, "DTRC", version (u16), record size (u16),
+steps recorded in all (u64), and records in the file (u32),
+followed by the records, oldest first, all little-endian.
+
+Running this module replays a trace file in the graphical view:
+
+    python tracing.py run.dtrace
+"""
+
+from cpu import CPU, CPUStep, TRACE_NO_DEST, TRACE_SKIPPED
+from instr_format import CondFlag, OpCode, decode
+
+import io
+import struct
+
+from typing import Iterator, List, NamedTuple
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+RECORD = struct.Struct("<iIbqqB")
+NO_DEST = TRACE_NO_DEST
+SKIPPED = TRACE_SKIPPED
+
+TRACE_MAGIC = b"DTRC"
+TRACE_VERSION = 2
+TRACE_HEADER = struct.Struct("<4sHHQI")
+
+
+class TraceRecord(NamedTuple):
+    """One step, unpacked"""
+    pc: int
+    word: int
+    dest: int
+    addr: int
+    result: int
+    cond: int
+
+
+def _wrap64(value: int) -> int:
+    """Python ints are unbounded; records hold 64 bits"""
+    return ((value + 0x8000000000000000) & 0xFFFFFFFFFFFFFFFF) - 0x8000000000000000
+
+
+class Trace(object):
+    """The last capacity steps of a CPU"""
+
+    def __init__(self, capacity: int=65536) -> None:
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD.size)
+        self.recorded = 0   # Steps recorded, including overwritten ones
+
+    def __len__(self) -> int:
+        return min(self.recorded, self.capacity)
+
+    def record(self, pc: int, word: int, dest: int, addr: int, result: int,
+               cond: int) -> None:
+        offset = (self.recorded % self.capacity) * RECORD.size
+        try:
+            RECORD.pack_into(self.buffer, offset, pc, word, dest, addr, result, cond)
+        except struct.error:
+            RECORD.pack_into(self.buffer, offset, pc, word & 0xFFFFFFFF, dest,
+                             _wrap64(addr), _wrap64(result), cond)
+        self.recorded += 1
+
+    def clear(self) -> None:
+        self.recorded = 0
+
+    def _ordered(self) -> bytes:
+        """Buffer contents, oldest record first"""
+        if self.recorded <= self.capacity:
+            return bytes(self.buffer[:self.recorded * RECORD.size])
+        start = (self.recorded % self.capacity) * RECORD.size
+        return bytes(self.buffer[start:]) + bytes(self.buffer[:start])
+
+    def records(self) -> List[TraceRecord]:
+        """Recorded steps, oldest first"""
+        return [TraceRecord(*fields) for fields in RECORD.iter_unpack(self._ordered())]
+
+    def write(self, file: io.IOBase) -> None:
+        """Write to a file opened in 'wb' mode"""
+        file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, RECORD.size,
+                                     self.recorded, len(self)))
+        file.write(self._ordered())
+
+
+def read_trace(file: io.IOBase) -> Iterator[TraceRecord]:
+    """Records of a trace file opened in 'rb' mode, oldest first"""
+    header = file.read(TRACE_HEADER.size)
+    if len(header) < TRACE_HEADER.size:
+        raise ValueError("Not a Duck Machine trace")
+    magic, version, size, recorded, count = TRACE_HEADER.unpack(header)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION or size != RECORD.size:
+        raise ValueError("Not a Duck Machine trace")
+    if recorded > count:
+        log.info(f"Trace starts after {recorded - count} unrecorded steps")
+    data = file.read(count * RECORD.size)
+    for fields in RECORD.iter_unpack(data):
+        yield TraceRecord(*fields)
+
+
+def replay(records: Iterator[TraceRecord], cpu: CPU) -> None:
+    """Repeat the effects of traced steps on cpu, notifying its
+    listeners (e.g., a MachineStateView) as the steps are replayed.
+    Nothing is executed, so cpu.memory should be plain memory,
+    without memory-mapped I/O.  Each record holds the value it
+    wrote, so a replay of the tail of a run (e.g., after the ring
+    buffer has wrapped) writes the same values the run did.
+    """
+    for record in records:
+        instr = decode(record.word)
+        if cpu.listeners:
+            cpu.notify_all(CPUStep(cpu, record.pc, record.word, instr))
+        cpu.registers[15].put(record.pc + 1)
+        if record.dest == SKIPPED:
+            continue
+        cpu.condition = CondFlag(record.cond)
+        if record.dest != NO_DEST:
+            cpu.registers[record.dest].put(record.result)
+        elif instr.op is OpCode.STORE:
+            if 0 <= record.addr < cpu.memory.capacity:
+                cpu.memory.put(record.addr, record.result)
+        cpu.halted = instr.op is OpCode.HALT or cpu.condition is CondFlag.V
+
+
+if __name__ == "__main__":
+    import argparse
+    from memory import Memory
+    import view
+    parser = argparse.ArgumentParser(description="Replay a Duck Machine trace")
+    parser.add_argument("tracefile", type=argparse.FileType("rb"),
+                        help="Trace file written by duck_machine.py --trace")
+    parser.add_argument("--capacity", type=int, default=512,
+                        help="Memory capacity of the traced machine")
+    args = parser.parse_args()
+    cpu = CPU(Memory(args.capacity))
+    display = view.MachineStateView(cpu, 1200, 800)
+    replay(read_trace(args.tracefile), cpu)
+    display.refresh()
+    input("Press enter to end")
@@ -3,23 +3,40 @@ Graphical display of the duck machine state.
 """
 
 from mvc import MVCEvent
-from cpu import CPU, CPUStep
+from cpu import CPU, CPUStep, CPUPause
 from memory import MemoryEvent, MemoryRead, MemoryWrite
 from memory import Memory
+from cache import CacheAccess, CacheHit, CacheMiss, CacheEvict
 
 import graphics.graphics
 from graphics.graphics import GraphWin, Rectangle, Point, Text
 
+from typing import Dict, Tuple
+import time
+
 import logging
 logging.basicConfig()
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+# Cell colors for memory reads and writes
+READ_COLOR = "#DDFFDD"
+WRITE_COLOR = "#DDDDFF"
+# Cell colors when the CPU uses a cache.Cache:  cells in a cached
+# line, and cached cells accessed with a hit or a miss
+EMPTY_COLOR = "#dddddd"
+CACHED_COLOR = "#FFF5CC"
+HIT_COLOR = "#CCFFCC"
+MISS_COLOR = "#FFCCCC"
+
 class MachineStateView(object):
-    """View of the CPU and memory state"""
+    """View of the CPU and memory state.  Changes are collected
+    as events arrive and drawn at most fps times per second,
+    touching only the registers and cells that changed.
+    """
 
     def __init__(self, model: CPU,
-                     width: int, height: int):
+                     width: int, height: int, fps: float=30):
         """Create a view width x height"""
         self.width = width
         self.height = height
@@ -27,7 +44,15 @@ class MachineStateView(object):
         model.register_listener(self)
         model.memory.register_listener(self)
 
-        self.window = graphics.graphics.GraphWin("Duck Machine", width, height)
+        # Pending changes, drawn at the next frame
+        self.frame_interval = 1.0 / fps
+        self._last_frame = 0.0
+        self._step = None            # Latest CPUStep not yet drawn
+        self._dirty_cells: Dict[int, Tuple[str, int]] = { }
+        self._shown_regs = 16 * [ None ]
+
+        self.window = graphics.graphics.GraphWin("Duck Machine", width, height,
+                                                 autoflush=False)
 
         # CPU in left 1/3 of window
         cpu_region = Rectangle(Point(5,5),
@@ -49,6 +74,7 @@ class MachineStateView(object):
 
         # Memory in right 2/3 of window
         self._draw_memory()
+        graphics.graphics.update()
 
     def _draw_instruction(self, in_rect):
         x_center = (in_rect.p1.x + in_rect.p2.x)/2.0
@@ -122,7 +148,7 @@ class MachineStateView(object):
         urx = llx + cell_width - 2
         ury = lly + cell_height - 2
         mem_cell = Rectangle(Point(llx,lly), Point(urx,ury))
-        mem_cell.setFill("#dddddd")
+        mem_cell.setFill(EMPTY_COLOR)
         mem_cell.draw(self.window)
         center = Point((llx + urx)/2, (lly+ury)/2)
         label = Text(center, ".")
@@ -132,10 +158,31 @@ class MachineStateView(object):
 
     def notify(self, event: MVCEvent):
         """Something to depict"""
+        if isinstance(event, CPUPause):
+            # Single stepping; show the step just completed
+            self.refresh()
+            return
         if isinstance(event, CPUStep):
-            self._cpu_step(event)
+            self._step = event
         elif isinstance(event, MemoryEvent):
             self._memory_event(event)
+        now = time.perf_counter()
+        if now - self._last_frame >= self.frame_interval:
+            self._last_frame = now
+            self.refresh()
+
+    def refresh(self):
+        """Draw all pending changes now"""
+        if self._step is not None:
+            self._cpu_step(self._step)
+            self._step = None
+        for address, (color, value) in self._dirty_cells.items():
+            cell_display = self.mem_cells[address]
+            cell_display.setFill(color)
+            if value is not None:
+                cell_display.label.setText(str(value))
+        self._dirty_cells.clear()
+        graphics.graphics.update()
 
     def _cpu_step(self, event: CPUStep):
         self.instr_raw.setText(str(event.instr_word))
@@ -143,35 +190,36 @@ class MachineStateView(object):
         for reg_index in range(16):
             # Index both the display and the model registers
             reg_value = self.model.registers[reg_index].get()
+            if reg_value == self._shown_regs[reg_index]:
+                continue
+            self._shown_regs[reg_index] = reg_value
             reg_display = self.registers[reg_index]
             reg_display.label.setText(str(reg_value))
 
     def _memory_event(self, event):
-        """Memory was accessed"""
-        log.debug("Memory event: {}".format(event))
-        memory = event.subject
+        """Memory was accessed; remember it for the next frame"""
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Memory event: {}".format(event))
+        if isinstance(event, CacheEvict):
+            self._color_line(event.addr, event.size, EMPTY_COLOR)
+            return
+        if isinstance(event, CacheMiss) and event.cached:
+            # The miss brought in the whole line
+            self._color_line(event.line, event.size, CACHED_COLOR)
         address = event.addr
-        value = event.value
-        if address >= len(self.mem_cells):
+        if address < 0 or address >= len(self.mem_cells):
             return
-        cell_display = self.mem_cells[address]
-        if isinstance(event, MemoryRead):
-            cell_display.setFill("#DDFFDD")
+        if isinstance(event, CacheAccess):
+            color = HIT_COLOR if isinstance(event, CacheHit) else MISS_COLOR
+            self._dirty_cells[address] = (color, event.value)
+        elif isinstance(event, MemoryRead):
+            self._dirty_cells[address] = (READ_COLOR, event.value)
         elif isinstance(event,MemoryWrite):
-            cell_display.setFill("#DDDDFF")
-        cell_display.label.setText(str(value))
-
-
-
-
-
-
-
-
-    
-            
-
-            
-            
-        
-            
+            self._dirty_cells[address] = (WRITE_COLOR, event.value)
+
+    def _color_line(self, start: int, size: int, color: str):
+        """Color cells start .. start + size - 1, keeping their values"""
+        for address in range(max(start, 0), min(start + size, len(self.mem_cells))):
+            # Keep a value change not yet drawn
+            value = self._dirty_cells.get(address, (None, None))[1]
+            self._dirty_cells[address] = (color, value)